@@ -0,0 +1,366 @@
+# Mode ASGI buat endpoint yang kerjaannya cuma nunggu upstream (/api/search & GET /api/stream/<yt_id>).
+# Outbound HTTP-nya pakai httpx.AsyncClient, jadi ribuan request yang lagi nunggu Piped cukup
+# jadi coroutine, bukan thread/worker yang nganggur. Route lain tetap dilayani Flask lewat a2wsgi
+# (thread pool ASGI_WSGI_WORKERS, per proses).
+#
+# Jalanin dari root repo:
+#   uvicorn asgi:app --app-dir api --workers 4
+from a2wsgi import WSGIMiddleware
+from contextlib import aclosing
+from urllib.parse import parse_qs, urlparse
+import asyncio, json, os, re, time
+import httpx
+
+import index as core
+from index import UpstreamError
+
+# Batas waktu total per request (detik), termasuk hedging & retry ke instance lain
+ASGI_SEARCH_DEADLINE = float(os.environ.get('ASGI_SEARCH_DEADLINE', 8))
+ASGI_STREAM_DEADLINE = float(os.environ.get('ASGI_STREAM_DEADLINE', 12))
+ASGI_MAX_CONNECTIONS = max(1, int(os.environ.get('ASGI_MAX_CONNECTIONS', 512)))
+ASGI_MAX_KEEPALIVE = max(1, int(os.environ.get('ASGI_MAX_KEEPALIVE', 64)))
+ASGI_WSGI_WORKERS = max(1, int(os.environ.get('ASGI_WSGI_WORKERS', 16)))
+
+STREAM_PATH = re.compile(r'^/api/stream/([^/]+)$')
+
+flask_app = WSGIMiddleware(core.app, workers=ASGI_WSGI_WORKERS)
+client = None
+
+def new_client():
+    return httpx.AsyncClient(
+        headers=core.UPSTREAM_HEADERS,
+        timeout=httpx.Timeout(core.UPSTREAM_READ_TIMEOUT, connect=core.UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=ASGI_MAX_CONNECTIONS, max_keepalive_connections=ASGI_MAX_KEEPALIVE),
+    )
+
+async def upstream_get(url, params=None, read_timeout=core.UPSTREAM_READ_TIMEOUT, retries=1):
+    # Versi async UpstreamClient.get: retry-nya tetap ngambil dari RetryBudget yang sama
+    budget = core.upstream.budget
+    budget.deposit()
+    timeout = httpx.Timeout(read_timeout, connect=core.UPSTREAM_CONNECT_TIMEOUT)
+    attempt = 0
+    while True:
+        try:
+            res = await client.get(url, params=params, timeout=timeout)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Sama kayak core: ReadTimeout gak di-retry
+            if attempt < retries and budget.withdraw():
+                attempt += 1
+                continue
+            raise
+        if res.status_code in core.UpstreamClient.RETRY_STATUS and attempt < retries and budget.withdraw():
+            attempt += 1
+            continue
+        return res
+
+class SingleFlight:
+    # Sama kayak core.SingleFlight tapi per event loop: yang nunggu cuma await task yang sama.
+    # Task-nya di-shield, jadi request yang kena deadline gak ikut ngebatalin buat yang lain.
+    def __init__(self, error_ttl):
+        self.error_ttl = error_ttl
+        self.calls = {}
+        self.errors = {}
+
+    async def do(self, key, fn, *args):
+        err = self.errors.get(key)
+        if err and err[1] > time.time(): raise err[0]
+        self.errors.pop(key, None)
+
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        self.calls.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.prune()
+            self.errors[key] = (task.exception(), time.time() + self.error_ttl)
+
+    def prune(self):
+        # Sama kayak core.SingleFlight.prune: yang expired dibuang dari depan
+        now = time.time()
+        while self.errors:
+            key = next(iter(self.errors))
+            if self.errors[key][1] > now: break
+            del self.errors[key]
+
+flights = SingleFlight(core.SINGLEFLIGHT_ERROR_TTL)
+
+class BatchFlight:
+    # Sama kayak core.BatchFlight: satu task producer per key, batch-nya dibagi ke semua yang nunggu.
+    # Task-nya gak ikut batal kalau client pertama putus.
+    def __init__(self):
+        self.calls = {}
+
+    async def iter(self, key, produce, *args):
+        call = self.calls.get(key)
+        if call is None:
+            call = self.calls[key] = {'batches': [], 'done': False, 'cond': asyncio.Condition()}
+            call['task'] = asyncio.ensure_future(self._run(key, call, produce, args))
+        seen = 0
+        while True:
+            async with call['cond']:
+                await call['cond'].wait_for(lambda: seen < len(call['batches']) or call['done'])
+                batches, done = call['batches'][seen:], call['done']
+            seen += len(batches)
+            for batch in batches: yield batch
+            if done: return
+
+    async def _run(self, key, call, produce, args):
+        try:
+            async with aclosing(produce(*args)) as batches:
+                async for batch in batches:
+                    async with call['cond']:
+                        call['batches'].append(batch)
+                        call['cond'].notify_all()
+        except Exception as e:
+            print(f"Error batch flight {key}: {e}")
+        finally:
+            self.calls.pop(key, None)
+            async with call['cond']:
+                call['done'] = True
+                call['cond'].notify_all()
+
+search_flights = BatchFlight()
+
+async def call_instance(base, fetch, *args):
+    start = time.monotonic()
+    try:
+        result = await fetch(base, *args)
+    except Exception as e:
+        core.upstream_health.record_failure(base, e)
+        core.metrics.observe('flinn_upstream_request_seconds', time.monotonic() - start, instance=base)
+        core.metrics.inc('flinn_upstream_failures_total', instance=base, cause=core.failure_cause(e))
+        raise
+    latency = time.monotonic() - start
+    core.upstream_health.record_success(base, latency)
+    core.metrics.observe('flinn_upstream_request_seconds', latency, instance=base)
+    return result
+
+async def hedged_iter(instances, fetch, fanout, hedge_delay, deadline=None):
+    # Port asyncio dari core.hedged_iter: yield (instance, hasil) sesuai urutan selesai,
+    # task yang masih jalan dibatalin begitu generator-nya ditutup. deadline (detik) dipakai
+    # sebagai timeout asyncio.wait, bukan asyncio.timeout di sekitar yield: yang dibatalin
+    # cuma task instance, bukan consumer yang lagi nunggu send().
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline if deadline is not None else None
+    queue = list(instances)
+    pending = {}
+    next_launch = 0.0
+    try:
+        while queue or pending:
+            if end is not None and loop.time() >= end: return
+            can_launch = queue and len(pending) < fanout
+            if can_launch and (not pending or loop.time() >= next_launch):
+                base = queue.pop(0)
+                pending[asyncio.ensure_future(fetch(base))] = base
+                next_launch = loop.time() + hedge_delay
+                continue
+
+            waits = [next_launch - loop.time()] if can_launch else []
+            if end is not None: waits.append(end - loop.time())
+            timeout = max(0.0, min(waits)) if waits else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                base = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception:
+                    result = None
+                if not result: next_launch = 0.0
+                yield base, result
+    finally:
+        for task in pending: task.cancel()
+
+async def search_instance(base, query):
+    res = await upstream_get(f"{base}/search", params={'q': query})
+    if not core.instance_ok(res): return []
+    return core.search_items(res.json())
+
+async def stream_instance(base, yt_id):
+    res = await upstream_get(f"{base}/streams/{yt_id}", read_timeout=5)
+    if not core.instance_ok(res): return None
+    return core.audio_url(res.json())
+
+def search_fetch(query):
+    return lambda base: call_instance(base, search_instance, query)
+
+async def search_upstream(qkey, query):
+    async with aclosing(hedged_iter(core.upstream_health.ranked(core.SEARCH_INSTANCES), search_fetch(query),
+                                    core.SEARCH_FANOUT, core.SEARCH_HEDGE_DELAY)) as results:
+        async for _, items in results:
+            if items:
+                await asyncio.to_thread(core.search_cache.put, qkey, items)
+                return items
+    raise UpstreamError("Gak ada instance yang ngasih hasil")
+
+async def search_batches(qkey, query, local):
+    # Sama kayak core.search_batches, cuma instance-nya ditunggu pakai asyncio
+    seen = set()
+
+    def fresh(items):
+        out = [item for item in items if item['videoId'] not in seen]
+        seen.update(item['videoId'] for item in out)
+        return out
+
+    if local: yield {"source": "library", "content": fresh(local)}
+
+    results, is_stale = await asyncio.to_thread(core.search_cache.get, qkey)
+    if results is not None:
+        if is_stale: core.search_cache.refresh_later(qkey, query)
+        if results: core.suggest_index.record_query(query)
+        yield {"source": "cache", "content": fresh(results)}
+        yield {"done": True}
+        return
+
+    # Cache miss: request barengan buat qkey yang sama cuma bikin satu fan-out
+    async with aclosing(search_flights.iter(('search', qkey), search_remote, qkey, query)) as batches:
+        async for base, items in batches:
+            new = fresh(items)
+            if new: yield {"source": urlparse(base).hostname, "content": new}
+    yield {"done": True}
+
+async def search_remote(qkey, query):
+    # Producer BatchFlight, sama kayak core.search_remote
+    remote = []
+    answered = 0
+    async with aclosing(hedged_iter(core.upstream_health.ranked(core.SEARCH_INSTANCES), search_fetch(query),
+                                    core.SEARCH_FANOUT, core.SEARCH_HEDGE_DELAY, ASGI_SEARCH_DEADLINE)) as batches:
+        async for base, items in batches:
+            if not items: continue
+            remote += items
+            yield base, items
+            answered += 1
+            if answered >= core.SEARCH_STREAM_SOURCES: break
+
+    if remote:
+        await asyncio.to_thread(core.search_cache.put, qkey, core.merge_results(remote))
+        core.suggest_index.record_query(query)
+
+async def resolve_stream(yt_id):
+    for base in core.upstream_health.ranked(core.STREAM_INSTANCES):
+        try:
+            url = await call_instance(base, stream_instance, yt_id)
+        except Exception:
+            continue
+        if url:
+            await asyncio.to_thread(core.stream_cache.put, yt_id, url)
+            return url
+
+    if core.YTDLP_FALLBACK:
+        try:
+            url = await asyncio.to_thread(core.ytdlp_resolver.resolve, yt_id)
+        except UpstreamError as e:
+            print(f"Error ytdlp resolve {yt_id}: {e}")
+        else:
+            await asyncio.to_thread(core.stream_cache.put, yt_id, url)
+            return url
+    raise UpstreamError("Semua server Piped sibuk")
+
+async def search(scope, receive, send):
+    args = parse_qs(scope['query_string'].decode('latin-1'))
+    query = args.get('q', [''])[0]
+    qkey = core.normalize_query(query) if query else ''
+    if not qkey: return await send_json(send, {"content": []})
+
+    local = []
+    if args.get('library', [''])[0] != '0':
+        rows = await asyncio.to_thread(core.search_library, qkey, core.LIBRARY_SEARCH_MERGE)
+        local = [core.library_result(s) for s in rows]
+
+    if args.get('stream', [''])[0] == '1':
+        return await send_ndjson(send, receive, search_batches(qkey, query, local))
+
+    results, is_stale = await asyncio.to_thread(core.search_cache.get, qkey)
+    if results is not None:
+        if is_stale: core.search_cache.refresh_later(qkey, query)
+    else:
+        try:
+            async with asyncio.timeout(ASGI_SEARCH_DEADLINE):
+                results = await flights.do(('search', qkey), search_upstream, qkey, query)
+        except (UpstreamError, TimeoutError):
+            results = []
+    if results: core.suggest_index.record_query(query)
+    await send_json(send, {"content": core.merge_results(local, results)})
+
+async def stream(scope, receive, send, yt_id):
+    if not core.valid_yt_id(yt_id): return await send_json(send, {"error": "yt_id gak valid"}, 400)
+    try:
+        async with asyncio.timeout(ASGI_STREAM_DEADLINE):
+            url = await asyncio.to_thread(core.stream_cache.get, yt_id) \
+                or await flights.do(('stream', yt_id), resolve_stream, yt_id)
+    except UpstreamError as e:
+        return await send_json(send, {"error": str(e)}, 500)
+    except TimeoutError:
+        return await send_json(send, {"error": "Kelamaan nunggu server Piped"}, 504)
+    data = {"url": url}
+    if core.AUDIO_PROXY: data["proxy"] = f"/api/stream/{yt_id}/audio"
+    await send_json(send, data)
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_ndjson(send, receive, batches):
+    # Client nutup koneksi -> generator ditutup, instance yang masih jalan ikut dibatalin
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect': pass
+
+    async def pump():
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/x-ndjson')]})
+        async with aclosing(batches):
+            async for batch in batches:
+                await send({'type': 'http.response.body', 'body': (json.dumps(batch) + '\n').encode('utf-8'),
+                            'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    pumping = asyncio.ensure_future(pump())
+    watching = asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait({pumping, watching}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watching.cancel()
+        if not pumping.done(): pumping.cancel()
+    if pumping.done() and not pumping.cancelled() and pumping.exception() is not None:
+        print(f"Error ndjson: {pumping.exception()!r}")
+
+async def lifespan(receive, send):
+    global client
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            client = new_client()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if client is not None: await client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    global client
+    if scope['type'] == 'lifespan': return await lifespan(receive, send)
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        if client is None: client = new_client()  # server yang gak ngirim lifespan
+        path = scope['path']
+        if path == '/api/search': return await timed_route('/api/search', search, scope, receive, send)
+        match = STREAM_PATH.match(path)
+        if match: return await timed_route('/api/stream/<yt_id>', stream, scope, receive, send, match.group(1))
+    await flask_app(scope, receive, send)
+
+async def timed_route(route, handler, scope, receive, send, *args):
+    # Sama kayak after_request di Flask: latency sampai header kekirim + header Server-Timing total
+    start = time.perf_counter()
+
+    async def timed_send(message):
+        if message['type'] == 'http.response.start':
+            elapsed = time.perf_counter() - start
+            message['headers'] = list(message['headers']) + [(b'server-timing', f"total;dur={elapsed * 1000:.1f}".encode())]
+            core.metrics.observe('flinn_http_request_seconds', elapsed, route=route, method='GET', status=message['status'])
+        await send(message)
+
+    await handler(scope, receive, timed_send, *args)
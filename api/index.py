@@ -1,35 +1,1436 @@
-from flask import Flask, render_template_string, jsonify, request
-import sqlite3, yt_dlp, os, requests
+from flask import Flask, Response, render_template_string, jsonify, request, send_file, g, has_request_context
+from flask.json.provider import DefaultJSONProvider
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+from werkzeug.utils import send_file as werkzeug_send_file
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+import sqlite3, os, requests, time, threading, json, unicodedata, re, bisect, heapq
+import gzip, hashlib, io, importlib.util, multiprocessing, ipaddress
+
+class TimedJSONProvider(DefaultJSONProvider):
+    # jsonify lewat sini -> waktu serialisasi masuk Server-Timing 'serialize'
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_timing('serialize', time.perf_counter() - start)
 
 app = Flask(__name__)
+app.json = TimedJSONProvider(app)
 
 # Database Config
 IS_VERCEL = "VERCEL" in os.environ
-DB_PATH = '/tmp/flinn_music.db' if IS_VERCEL else 'flinn_music.db'
+DB_PATH = os.environ.get('DB_PATH', '/tmp/flinn_music.db' if IS_VERCEL else 'flinn_music.db')
+
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+SQLITE_CACHE_KB = max(1, int(os.environ.get('SQLITE_CACHE_KB', 8192)))
+SQLITE_MMAP_SIZE = max(0, int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024)))
+
+# Upstream Config
+# SEARCH_FANOUT = berapa instance boleh jalan barengan, SEARCH_HEDGE_DELAY = jeda (detik)
+# sebelum instance berikutnya ikut ditembak. Fanout 1 = sequential kayak dulu,
+# hedge 0 = langsung paralel semua sesuai fanout.
+SEARCH_FANOUT = max(1, int(os.environ.get('SEARCH_FANOUT', 3)))
+SEARCH_HEDGE_DELAY = max(0.0, float(os.environ.get('SEARCH_HEDGE_DELAY', 0.35)))
+UPSTREAM_WORKERS = max(1, int(os.environ.get('UPSTREAM_WORKERS', 32)))
+
+# Daftar server buat ambil link audio
+STREAM_INSTANCES = [
+    'https://pipedapi.kavin.rocks',
+    'https://pipedapi.lcom.cloud',
+    'https://pipedapi.mha.fi',
+    'https://pipedapi.drgns.space'
+]
+
+# Daftar server Piped yang lebih luas dan terbaru
+SEARCH_INSTANCES = [
+    'https://pipedapi.kavin.rocks',
+    'https://pipedapi.lcom.cloud',
+    'https://pipedapi.mha.fi',
+    'https://pipedapi.leptons.xyz',
+    'https://pipedapi.astoria.ws',
+    'https://pipedapi.demover.me',
+    'https://pipedapi.rivo.lol'
+]
+
+# Dua daftar di atas bisa diganti lewat env (dipisah koma), misal buat benchmark ke mock Piped lokal
+if os.environ.get('PIPED_STREAM_INSTANCES'):
+    STREAM_INSTANCES = [u.strip().rstrip('/') for u in os.environ['PIPED_STREAM_INSTANCES'].split(',') if u.strip()]
+if os.environ.get('PIPED_SEARCH_INSTANCES'):
+    SEARCH_INSTANCES = [u.strip().rstrip('/') for u in os.environ['PIPED_SEARCH_INSTANCES'].split(',') if u.strip()]
+
+# Outbound HTTP Config
+# Semua request ke Piped lewat satu Session: koneksi keep-alive di-pool per host
+# (UPSTREAM_POOL_SIZE, bisa di-override per host lewat UPSTREAM_HOST_POOL_SIZES
+# format "host=ukuran,host=ukuran"). Retry cuma boleh selama budget-nya masih ada:
+# tiap request nabung UPSTREAM_RETRY_RATIO token, tiap retry makan 1 token.
+UPSTREAM_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/121.0.0.0'}
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 2))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 4))
+UPSTREAM_POOL_SIZE = max(1, int(os.environ.get('UPSTREAM_POOL_SIZE', 16)))
+UPSTREAM_HOST_POOL_SIZES = {
+    host.strip(): int(size)
+    for host, _, size in (item.partition('=') for item in os.environ.get('UPSTREAM_HOST_POOL_SIZES', '').split(','))
+    if host.strip() and size.strip().isdigit()
+}
+UPSTREAM_RETRY_RATIO = float(os.environ.get('UPSTREAM_RETRY_RATIO', 0.1))
+UPSTREAM_RETRY_BURST = float(os.environ.get('UPSTREAM_RETRY_BURST', 10))
+
+# Circuit breaker: setelah CIRCUIT_FAILURES gagal beruntun instance di-skip selama
+# CIRCUIT_OPEN_SECONDS (dobel tiap kali gagal lagi, mentok di CIRCUIT_MAX_OPEN_SECONDS)
+CIRCUIT_FAILURES = max(1, int(os.environ.get('CIRCUIT_FAILURES', 3)))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 30))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.environ.get('CIRCUIT_MAX_OPEN_SECONDS', 600))
+
+# Stream Cache Config
+# Link googlevideo ada `expire=` (unix timestamp), kita buang STREAM_CACHE_MARGIN detik
+# sebelum itu biar lagu gak putus di tengah. Kalau gak ada expire pakai STREAM_CACHE_DEFAULT_TTL.
+STREAM_CACHE_SIZE = max(1, int(os.environ.get('STREAM_CACHE_SIZE', 1000)))
+STREAM_CACHE_MARGIN = float(os.environ.get('STREAM_CACHE_MARGIN', 300))
+STREAM_CACHE_DEFAULT_TTL = float(os.environ.get('STREAM_CACHE_DEFAULT_TTL', 3600))
+
+# Audio Proxy Config
+# /api/stream/<yt_id>/audio nerusin byte audio dari googlevideo per AUDIO_CHUNK_SIZE,
+# kalau link-nya expired di tengah jalan di-resolve ulang maksimal AUDIO_PROXY_RESUMES kali.
+AUDIO_PROXY = os.environ.get('AUDIO_PROXY', '1') != '0'
+AUDIO_CHUNK_SIZE = max(4096, int(os.environ.get('AUDIO_CHUNK_SIZE', 64 * 1024)))
+AUDIO_PROXY_RESUMES = max(0, int(os.environ.get('AUDIO_PROXY_RESUMES', 3)))
+AUDIO_READ_TIMEOUT = float(os.environ.get('AUDIO_READ_TIMEOUT', 15))
+
+# Audio Cache Config
+# Potongan audio yang pernah lewat proxy disimpan di disk per AUDIO_CACHE_SEGMENT byte
+# (file sparse per yt_id, daftar segmennya di SQLite). Total dibatasi AUDIO_CACHE_MAX_BYTES,
+# yang dibuang duluan ditentukan AUDIO_CACHE_POLICY: 'lru' atau 'lfu'.
+AUDIO_CACHE = os.environ.get('AUDIO_CACHE', '1') != '0'
+AUDIO_CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR', '/tmp/flinn_audio' if IS_VERCEL else 'flinn_audio_cache')
+AUDIO_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_CACHE_MAX_BYTES', (256 if IS_VERCEL else 1024) * 1024 * 1024))
+AUDIO_CACHE_MAX_FILE = int(os.environ.get('AUDIO_CACHE_MAX_FILE', 64 * 1024 * 1024))
+AUDIO_CACHE_SEGMENT = max(AUDIO_CHUNK_SIZE, int(os.environ.get('AUDIO_CACHE_SEGMENT', 256 * 1024)))
+AUDIO_CACHE_POLICY = os.environ.get('AUDIO_CACHE_POLICY', 'lru').lower()
+
+# Thumbnail Config
+# /api/thumb/<yt_id>?w= ngambil cover sekali, dikecilin ke ukuran terdekat di THUMB_SIZES
+# (WebP kalau browser-nya mau, selain itu JPEG). Semua file di THUMB_DIR dibatasi
+# THUMB_MAX_BYTES, yang paling lama gak dipakai dibuang duluan. Tanpa Pillow gambar aslinya dikirim apa adanya.
+# Cover dari library cuma diambil kalau host-nya ada di THUMB_HOSTS atau subdomain instance Piped
+# (image proxy-nya, misal pipedproxy.kavin.rocks); selain itu langsung pakai i.ytimg.com.
+THUMB_DIR = os.environ.get('THUMB_DIR', '/tmp/flinn_thumbs' if IS_VERCEL else 'flinn_thumb_cache')
+THUMB_MAX_BYTES = int(os.environ.get('THUMB_MAX_BYTES', (32 if IS_VERCEL else 128) * 1024 * 1024))
+THUMB_SIZES = sorted({max(16, int(w)) for w in os.environ.get('THUMB_SIZES', '96,192,480').split(',') if w.strip()})
+THUMB_QUALITY = max(1, min(95, int(os.environ.get('THUMB_QUALITY', 75))))
+THUMB_SOURCE_MAX = int(os.environ.get('THUMB_SOURCE_MAX', 4 * 1024 * 1024))
+THUMB_WEBP = Image is not None and features.check('webp')
+THUMB_HOSTS = {h.strip().lower() for h in os.environ.get('THUMB_HOSTS', 'i.ytimg.com').split(',') if h.strip()}
+
+# Prefetch Config
+# Client ngirim PREFETCH_MAX lagu berikutnya, server resolve link-nya + narik
+# PREFETCH_HEAD_BYTES pertama ke audio cache pakai PREFETCH_WORKERS thread.
+PREFETCH_MAX = max(1, int(os.environ.get('PREFETCH_MAX', 5)))
+PREFETCH_WORKERS = max(1, int(os.environ.get('PREFETCH_WORKERS', 4)))
+PREFETCH_HEAD_BYTES = max(AUDIO_CACHE_SEGMENT, int(os.environ.get('PREFETCH_HEAD_BYTES', 1024 * 1024)))
+
+# Batch Resolve Config
+BATCH_MAX_IDS = max(1, int(os.environ.get('BATCH_MAX_IDS', 200)))
+BATCH_PARALLELISM = max(1, int(os.environ.get('BATCH_PARALLELISM', 8)))
+
+# yt-dlp Fallback Config
+# Kalau semua instance Piped gagal, link di-extract lokal pakai yt-dlp di YTDLP_WORKERS
+# proses yang di-fork pas fallback pertama kali dipakai (per proses server) & langsung import yt_dlp
+# (modul berat, gak ikut di-import di proses utama). Kalau proses gak bisa dibikin (Vercel/Lambda
+# gak punya /dev/shm buat semaphore), turun ke YTDLP_WORKERS thread.
+# Maksimal YTDLP_WORKERS * 2 request ngantri, tiap extract dibatasi YTDLP_TIMEOUT detik.
+YTDLP_FALLBACK = os.environ.get('YTDLP_FALLBACK', '1') != '0'
+YTDLP_WORKERS = max(1, int(os.environ.get('YTDLP_WORKERS', 1 if IS_VERCEL else 2)))
+YTDLP_TIMEOUT = float(os.environ.get('YTDLP_TIMEOUT', 20))
+
+# Library Sync Config
+# /api/content?limit=&cursor= -> halaman keyset by id. Tiap add/delete naikin versi
+# library dan nyatet changelog (LIBRARY_CHANGELOG_KEEP terakhir) buat ?since=<versi>.
+# Batasnya disimpen di library_meta tiap startup & dibaca trigger, jadi ganti env-nya langsung kepake.
+LIBRARY_PAGE_MAX = max(1, int(os.environ.get('LIBRARY_PAGE_MAX', 500)))
+LIBRARY_CHANGELOG_KEEP = max(100, int(os.environ.get('LIBRARY_CHANGELOG_KEEP', 10000)))
+
+# Playlist Import Config
+IMPORT_MAX_PAGES = max(1, int(os.environ.get('IMPORT_MAX_PAGES', 100)))
+
+# Search versi streaming (?stream=1) nggabungin hasil dari maksimal sekian instance
+SEARCH_STREAM_SOURCES = max(1, int(os.environ.get('SEARCH_STREAM_SOURCES', 2)))
+# Fan-out search streaming (satu per query yang lagi jalan) dikerjain maksimal sekian thread
+SEARCH_STREAM_WORKERS = max(1, int(os.environ.get('SEARCH_STREAM_WORKERS', 16)))
+
+# Suggest Config: batas jumlah entry per index prefix (query & library)
+SUGGEST_MAX_TERMS = max(100, int(os.environ.get('SUGGEST_MAX_TERMS', 20000)))
+
+# Library Search Config
+LIBRARY_SEARCH_MERGE = max(0, int(os.environ.get('LIBRARY_SEARCH_MERGE', 5)))
+
+# App Shell Config
+# HTML di-render & dikompres sekali waktu startup. CSS-nya pakai URL ber-hash jadi
+# boleh di-cache selamanya; HTML-nya di-cache SHELL_MAX_AGE detik lalu divalidasi ulang via ETag.
+SHELL_MAX_AGE = max(0, int(os.environ.get('SHELL_MAX_AGE', 3600)))
+# Service worker (/sw.js): batas jumlah thumbnail & lagu library yang disimpan di browser buat offline
+OFFLINE_THUMBS_MAX = max(0, int(os.environ.get('OFFLINE_THUMBS_MAX', 500)))
+OFFLINE_AUDIO_MAX = max(0, int(os.environ.get('OFFLINE_AUDIO_MAX', 30)))
+
+# Search Cache Config
+# Lebih muda dari SEARCH_CACHE_TTL = fresh. Sampai SEARCH_CACHE_MAX_STALE masih dikirim
+# langsung tapi di-refresh di background. Lewat itu dianggap gak ada.
+SEARCH_CACHE_SIZE = max(1, int(os.environ.get('SEARCH_CACHE_SIZE', 2000)))
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 6 * 3600))
+SEARCH_CACHE_MAX_STALE = float(os.environ.get('SEARCH_CACHE_MAX_STALE', 7 * 24 * 3600))
+
+# Request identik yang datang barengan cuma nembak upstream sekali. Kalau gagal,
+# error-nya diingat SINGLEFLIGHT_ERROR_TTL detik biar gak langsung diserbu lagi.
+SINGLEFLIGHT_ERROR_TTL = float(os.environ.get('SINGLEFLIGHT_ERROR_TTL', 5))
+
+upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix='upstream')
+# Kerjaan background (refresh cache dll) dipisah biar gak rebutan slot sama upstream_pool
+background_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='background')
+prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='prefetch')
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_PARALLELISM * 4, thread_name_prefix='batch')
+search_stream_pool = ThreadPoolExecutor(max_workers=SEARCH_STREAM_WORKERS, thread_name_prefix='search-stream')
+
+class Metrics:
+    # Registry Prometheus bikinan sendiri: counter, gauge, histogram (bucket kumulatif).
+    # Angkanya per proses; /metrics tinggal nge-render semuanya ke format text.
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        self.values = {}
+
+    def register(self, kind, name, help_text, buckets=None):
+        self.families[name] = (kind, help_text, buckets)
+        self.values[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self.families[name][2]
+        with self.lock:
+            series = self.values[name]
+            hist = series.get(key)
+            if hist is None: hist = series[key] = [[0] * len(buckets), 0.0, 0]
+            i = bisect.bisect_left(buckets, value)
+            if i < len(buckets): hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs: return ''
+        esc = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in pairs) + '}'
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in self.families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(self.values[name].items()):
+                    if kind != 'histogram':
+                        lines.append(f"{name}{self._labels(key)} {value}")
+                        continue
+                    counts, total, n = value
+                    running = 0
+                    for bound, count in zip(buckets, counts):
+                        running += count
+                        lines.append(f"{name}_bucket{self._labels(key + (('le', repr(float(bound))),))} {running}")
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', '+Inf'),))} {n}")
+                    lines.append(f"{name}_sum{self._labels(key)} {total}")
+                    lines.append(f"{name}_count{self._labels(key)} {n}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.register('histogram', 'flinn_http_request_seconds', 'Latency request per route (sampai header kekirim)', Metrics.LATENCY_BUCKETS)
+metrics.register('histogram', 'flinn_upstream_request_seconds', 'Latency panggilan ke instance Piped', Metrics.LATENCY_BUCKETS)
+metrics.register('counter', 'flinn_upstream_failures_total', 'Panggilan instance Piped yang gagal, per penyebab')
+metrics.register('gauge', 'flinn_upstream_circuit_open', '1 kalau circuit breaker instance lagi kebuka')
+metrics.register('counter', 'flinn_cache_requests_total', 'Lookup cache per hasil (hit/stale/miss)')
+metrics.register('histogram', 'flinn_sqlite_query_seconds', 'Waktu eksekusi statement SQLite',
+                 (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1))
+
+def failure_cause(error):
+    # Label penyebab gagal yang jumlahnya terbatas (biar series-nya gak meledak)
+    name = type(error).__name__
+    text = str(error)
+    if isinstance(error, UpstreamError) and text.startswith('HTTP '): return f"http_{text[5:6]}xx"
+    if 'Timeout' in name: return 'timeout'
+    if 'Connect' in name: return 'connect'
+    if isinstance(error, ValueError): return 'parse'
+    return 'other'
+
+def add_timing(name, seconds):
+    # Dikumpulin per request buat header Server-Timing
+    if not has_request_context(): return
+    timings = g.setdefault('timings', {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+@contextmanager
+def timed(name):
+    # Yang nested (misal flight di dalam flight) cuma dihitung sekali di paling luar
+    outer = has_request_context() and name not in g.setdefault('timing_open', set())
+    if outer: g.timing_open.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if outer:
+            g.timing_open.discard(name)
+            add_timing(name, time.perf_counter() - start)
+
+class UpstreamError(Exception):
+    pass
+
+class RetryBudget:
+    # Token bucket global buat retry, biar pas upstream lagi down kita gak ikut nge-DDoS
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1: return False
+            self.tokens -= 1
+            return True
+
+class UpstreamClient:
+    RETRY_STATUS = (502, 503, 504)
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.session.headers.update(UPSTREAM_HEADERS)
+        self.budget = RetryBudget(UPSTREAM_RETRY_RATIO, UPSTREAM_RETRY_BURST)
+
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=UPSTREAM_POOL_SIZE, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        for host, size in UPSTREAM_HOST_POOL_SIZES.items():
+            host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0)
+            self.session.mount(f"https://{host}", host_adapter)
+            self.session.mount(f"http://{host}", host_adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, params=None, headers=None, read_timeout=UPSTREAM_READ_TIMEOUT, retries=1,
+                stream=False, allow_redirects=True):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                res = self.session.request(method, url, params=params, headers=headers, stream=stream,
+                                           timeout=(UPSTREAM_CONNECT_TIMEOUT, read_timeout),
+                                           allow_redirects=allow_redirects)
+            except requests.ConnectionError as e:
+                # Cuma gagal connect yang di-retry. Read timeout (termasuk yang dibungkus ConnectionError
+                # waktu body-nya dibaca) artinya instance-nya ngegantung: retry cuma nambah satu timeout penuh.
+                stalled = bool(e.args) and isinstance(e.args[0], ReadTimeoutError)
+                if not stalled and attempt < retries and self.budget.withdraw():
+                    attempt += 1
+                    continue
+                raise
+            if res.status_code in self.RETRY_STATUS and attempt < retries and self.budget.withdraw():
+                res.close()
+                attempt += 1
+                continue
+            return res
+
+upstream = UpstreamClient()
+
+class UpstreamHealth:
+    # Papan skor per instance Piped: EWMA latency, EWMA error rate, gagal terakhir,
+    # plus circuit breaker (closed -> open -> half-open probe -> closed).
+    ALPHA = 0.3
+    DEFAULT_LATENCY = 1.0
+    PROBE_TIMEOUT = 5.0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def _get(self, base):
+        st = self.stats.get(base)
+        if st is None:
+            st = self.stats[base] = {
+                'latency': None, 'error_rate': 0.0, 'failures': 0,
+                'last_failure': None, 'last_error': None,
+                'open_until': 0.0, 'open_seconds': CIRCUIT_OPEN_SECONDS, 'probe_until': 0.0,
+            }
+        return st
+
+    def _score(self, st):
+        latency = st['latency'] if st['latency'] is not None else self.DEFAULT_LATENCY
+        return latency * (1 + 4 * st['error_rate'])
+
+    def ranked(self, instances):
+        # Urutin dari yang paling sehat. Instance yang circuit-nya kebuka gak ikut sama sekali
+        # (fail-fast, gak ditunggu inline tiap request); yang udah lewat masa open dicek ulang
+        # lewat probe /healthcheck di background, dan baru balik ke daftar kalau probe-nya sukses.
+        now = time.time()
+        healthy, probes = [], []
+        with self.lock:
+            for base in instances:
+                st = self._get(base)
+                if not st['open_until']:
+                    healthy.append(base)
+                elif now >= st['open_until'] and now >= st['probe_until']:
+                    st['probe_until'] = now + self.PROBE_TIMEOUT
+                    probes.append(base)
+            healthy.sort(key=lambda b: self._score(self.stats[b]))
+        for base in probes:
+            upstream_pool.submit(self.probe, base)
+        return healthy
+
+    def probe(self, base):
+        start = time.monotonic()
+        try:
+            res = upstream.get(f"{base}/healthcheck", read_timeout=self.PROBE_TIMEOUT, retries=0)
+            instance_ok(res)
+        except Exception as e:
+            self.record_failure(base, e)
+        else:
+            self.record_success(base, time.monotonic() - start)
+
+    def record_success(self, base, latency):
+        with self.lock:
+            st = self._get(base)
+            st['latency'] = latency if st['latency'] is None else (
+                self.ALPHA * latency + (1 - self.ALPHA) * st['latency'])
+            st['error_rate'] *= (1 - self.ALPHA)
+            st['failures'] = 0
+            st['open_until'] = 0.0
+            st['open_seconds'] = CIRCUIT_OPEN_SECONDS
+            st['probe_until'] = 0.0
+
+    def record_failure(self, base, error):
+        now = time.time()
+        with self.lock:
+            st = self._get(base)
+            st['error_rate'] = self.ALPHA + (1 - self.ALPHA) * st['error_rate']
+            st['failures'] += 1
+            st['last_failure'] = now
+            st['last_error'] = f"{type(error).__name__}: {error}"
+            st['probe_until'] = 0.0
+            if st['open_until']:
+                # Probe half-open gagal -> buka lagi, cooldown dobel
+                st['open_seconds'] = min(st['open_seconds'] * 2, CIRCUIT_MAX_OPEN_SECONDS)
+                st['open_until'] = now + st['open_seconds']
+            elif st['failures'] >= CIRCUIT_FAILURES:
+                st['open_until'] = now + st['open_seconds']
+
+upstream_health = UpstreamHealth()
+
+def instance_ok(res):
+    # Cuma 5xx / 429 yang salah instance-nya (masuk papan skor lewat exception). 4xx lain itu
+    # soal request-nya (video / playlist gak ada, private): jawaban sukses, cuma gak ada hasil.
+    if res.status_code >= 500 or res.status_code == 429: raise UpstreamError(f"HTTP {res.status_code}")
+    return res.status_code == 200
+
+class SingleFlight:
+    # Gabungin panggilan identik yang lagi jalan: satu jadi leader, sisanya nunggu hasilnya
+    def __init__(self, error_ttl):
+        self.error_ttl = error_ttl
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.errors = {}
+
+    def do(self, key, fn, *args):
+        # Semua flight = kerjaan nunggu upstream, jadi waktunya masuk Server-Timing 'upstream'
+        with timed('upstream'):
+            return self._do(key, fn, *args)
+
+    def _do(self, key, fn, *args):
+        with self.lock:
+            err = self.errors.get(key)
+            if err and err[1] > time.time(): raise err[0]
+            self.errors.pop(key, None)
+
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None: raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn(*args)
+        except Exception as e:
+            call['error'] = e
+        with self.lock:
+            self.calls.pop(key, None)
+            if call['error'] is not None:
+                self.prune()
+                self.errors[key] = (call['error'], time.time() + self.error_ttl)
+        call['done'].set()
+
+        if call['error'] is not None: raise call['error']
+        return call['result']
+
+    def prune(self):
+        # TTL-nya sama semua, jadi urutan masuk dict = urutan expired. Buang dari depan
+        # biar key gagal yang gak pernah diminta lagi gak numpuk selamanya.
+        now = time.time()
+        while self.errors:
+            key = next(iter(self.errors))
+            if self.errors[key][1] > now: break
+            del self.errors[key]
+
+flights = SingleFlight(SINGLEFLIGHT_ERROR_TTL)
+
+class BatchFlight:
+    # SingleFlight buat hasil yang datang bertahap (search ?stream=1). Satu producer per key jalan
+    # di pool (dibatasi, kayak kerjaan background lain) & nge-publish tiap batch; semua request buat key itu (termasuk yang datang
+    # belakangan) dapat batch yang udah lewat + yang nyusul. Producer tetap jalan sampai selesai
+    # walau client pertamanya putus, jadi yang lain gak kegantung.
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def iter(self, key, produce, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = {'batches': [], 'done': False, 'cond': threading.Condition(self.lock)}
+                self.pool.submit(self._run, key, call, produce, args)
+        seen = 0
+        while True:
+            with self.lock:
+                while seen >= len(call['batches']) and not call['done']: call['cond'].wait()
+                batches, done = call['batches'][seen:], call['done']
+            seen += len(batches)
+            yield from batches
+            if done: return
+
+    def _run(self, key, call, produce, args):
+        try:
+            for batch in produce(*args):
+                with self.lock:
+                    call['batches'].append(batch)
+                    call['cond'].notify_all()
+        except Exception as e:
+            print(f"Error batch flight {key}: {e}")
+        finally:
+            with self.lock:
+                call['done'] = True
+                self.calls.pop(key, None)
+                call['cond'].notify_all()
+
+search_flights = BatchFlight(search_stream_pool)
+
+# Dua fungsi ini jalan di worker yt-dlp (proses, atau thread kalau lagi mode fallback).
+# YoutubeDL gak thread-safe, jadi instance-nya satu per thread.
+ytdlp = threading.local()
+
+def ytdlp_warm():
+    if getattr(ytdlp, 'ydl', None) is None:
+        import yt_dlp
+        ytdlp.ydl = yt_dlp.YoutubeDL({
+            'format': 'bestaudio[ext=m4a]/bestaudio/best',
+            'quiet': True, 'no_warnings': True, 'noplaylist': True,
+            'socket_timeout': YTDLP_TIMEOUT / 2, 'cachedir': False,
+        })
+    return os.getpid()
+
+def ytdlp_extract(yt_id):
+    ytdlp_warm()
+    info = ytdlp.ydl.extract_info(f"https://www.youtube.com/watch?v={yt_id}", download=False)
+    return info.get('url')
+
+class YtdlpResolver:
+    def __init__(self, workers, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.pool = None
+        self.pid = None
+
+    def start(self):
+        # Cuma ngecek yt_dlp ada. Pool-nya belum dibikin di sini: fork waktu import kebawa ke
+        # server pre-fork (gunicorn --preload) dan worker-nya dapat executor yang thread manager-nya mati.
+        if importlib.util.find_spec('yt_dlp') is None:
+            print("Error ytdlp start: modul yt_dlp gak ada, fallback dimatiin")
+            return False
+        self.enabled = True
+        return True
+
+    def new_pool(self):
+        # Warm-up langsung di-submit biar import yt_dlp kejadian di worker, bukan pas user nunggu
+        try:
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'))
+        except (OSError, ValueError, NotImplementedError) as e:
+            print(f"Error ytdlp process pool: {e}, pakai thread")
+            pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ytdlp')
+        for _ in range(self.workers):
+            pool.submit(ytdlp_warm)
+        return pool
+
+    def executor(self):
+        # Satu pool per proses: habis fork, pool & slot punya parent dianggap gak ada
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pool, self.pid = self.new_pool(), os.getpid()
+                self.slots = threading.BoundedSemaphore(self.workers * 2)
+            return self.pool, self.slots
+
+    def restart(self, broken):
+        with self.lock:
+            if self.pool is not broken: return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.new_pool()
+
+    def resolve(self, yt_id):
+        if not self.enabled: raise UpstreamError("yt-dlp gak aktif")
+        pool, slots = self.executor()
+        if not slots.acquire(timeout=1): raise UpstreamError("yt-dlp lagi penuh")
+        try:
+            future = pool.submit(ytdlp_extract, yt_id)
+        except (BrokenProcessPool, RuntimeError) as e:
+            slots.release()
+            self.restart(pool)
+            raise UpstreamError(f"yt-dlp: {e}")
+        # Slot baru dibalikin kalau extract-nya beneran selesai, jadi yang timeout tetap kehitung
+        future.add_done_callback(lambda f: slots.release())
+
+        try:
+            url = future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            raise UpstreamError("yt-dlp timeout")
+        except BrokenProcessPool as e:
+            self.restart(pool)
+            raise UpstreamError(f"yt-dlp: {e}")
+        except Exception as e:
+            raise UpstreamError(f"yt-dlp: {e}")
+        if not url: raise UpstreamError("yt-dlp gak nemu audio")
+        return url
+
+ytdlp_resolver = YtdlpResolver(YTDLP_WORKERS, YTDLP_TIMEOUT)
+
+def stream_expiry(url):
+    # Kapan link audio ini harus dianggap basi
+    try:
+        expire = float(parse_qs(urlparse(url).query)['expire'][0])
+    except (KeyError, IndexError, ValueError):
+        expire = time.time() + STREAM_CACHE_DEFAULT_TTL
+    return expire - STREAM_CACHE_MARGIN
+
+class StreamCache:
+    # Cache link audio per yt_id: LRU di memori (biar repeat play < 1ms) + salinan di
+    # SQLite biar tetap hidup setelah restart. Dua-duanya dibatasi max_entries.
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def _remember(self, yt_id, url, expires_at):
+        self.entries[yt_id] = (url, expires_at)
+        self.entries.move_to_end(yt_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, yt_id):
+        now = time.time()
+        with self.lock:
+            hit = self.entries.get(yt_id)
+            if hit and hit[1] > now:
+                self.entries.move_to_end(yt_id)
+                metrics.inc('flinn_cache_requests_total', cache='stream', result='hit')
+                return hit[0]
+            if hit:
+                del self.entries[yt_id]
+
+        try:
+            with get_db() as conn:
+                row = conn.execute('SELECT url, expires_at FROM stream_cache WHERE yt_id = ?', (yt_id,)).fetchone()
+                if row and row['expires_at'] <= now:
+                    conn.execute('DELETE FROM stream_cache WHERE yt_id = ?', (yt_id,))
+                    row = None
+                if row:
+                    conn.execute('UPDATE stream_cache SET last_used = ? WHERE yt_id = ?', (now, yt_id))
+        except sqlite3.Error as e:
+            print(f"Error stream_cache get: {e}")
+            row = None
+        metrics.inc('flinn_cache_requests_total', cache='stream', result='hit' if row else 'miss')
+        if not row: return None
+
+        with self.lock:
+            self._remember(yt_id, row['url'], row['expires_at'])
+        return row['url']
+
+    def put(self, yt_id, url):
+        now = time.time()
+        expires_at = stream_expiry(url)
+        if expires_at <= now: return
+
+        with self.lock:
+            self._remember(yt_id, url, expires_at)
+        try:
+            with get_db() as conn:
+                conn.execute('INSERT OR REPLACE INTO stream_cache (yt_id, url, expires_at, last_used) VALUES (?,?,?,?)',
+                             (yt_id, url, expires_at, now))
+                # Buang yang paling lama gak dipakai kalau udah lewat batas
+                conn.execute('''DELETE FROM stream_cache WHERE yt_id IN (
+                    SELECT yt_id FROM stream_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)''',
+                             (self.max_entries,))
+        except sqlite3.Error as e:
+            print(f"Error stream_cache put: {e}")
+
+    def invalidate(self, yt_id):
+        with self.lock:
+            self.entries.pop(yt_id, None)
+        try:
+            with get_db() as conn:
+                conn.execute('DELETE FROM stream_cache WHERE yt_id = ?', (yt_id,))
+        except sqlite3.Error as e:
+            print(f"Error stream_cache invalidate: {e}")
+
+stream_cache = StreamCache(STREAM_CACHE_SIZE)
+
+def normalize_query(query):
+    # "  Béyoncé   HALO " -> "beyonce halo"
+    folded = unicodedata.normalize('NFKD', query)
+    folded = ''.join(ch for ch in folded if not unicodedata.combining(ch))
+    return ' '.join(folded.casefold().split())
+
+class SearchCache:
+    # Hasil search per query yang udah dinormalisasi, disimpan di SQLite.
+    # Entry basi tetap dikirim langsung, refresh-nya jalan di background_pool.
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.refreshing = set()
+
+    def get(self, qkey):
+        # -> (results, is_stale) atau (None, False)
+        now = time.time()
+        try:
+            with get_db() as conn:
+                row = conn.execute('SELECT results, fetched_at FROM search_cache WHERE qkey = ?', (qkey,)).fetchone()
+                if row and now - row['fetched_at'] > SEARCH_CACHE_MAX_STALE:
+                    conn.execute('DELETE FROM search_cache WHERE qkey = ?', (qkey,))
+                    row = None
+                if row:
+                    conn.execute('UPDATE search_cache SET last_used = ? WHERE qkey = ?', (now, qkey))
+        except sqlite3.Error as e:
+            print(f"Error search_cache get: {e}")
+            row = None
+        if not row:
+            metrics.inc('flinn_cache_requests_total', cache='search', result='miss')
+            return None, False
+        is_stale = now - row['fetched_at'] > SEARCH_CACHE_TTL
+        metrics.inc('flinn_cache_requests_total', cache='search', result='stale' if is_stale else 'hit')
+        return json.loads(row['results']), is_stale
+
+    def put(self, qkey, results):
+        now = time.time()
+        try:
+            with get_db() as conn:
+                conn.execute('INSERT OR REPLACE INTO search_cache (qkey, results, fetched_at, last_used) VALUES (?,?,?,?)',
+                             (qkey, json.dumps(results), now, now))
+                conn.execute('''DELETE FROM search_cache WHERE qkey IN (
+                    SELECT qkey FROM search_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)''',
+                             (self.max_entries,))
+        except sqlite3.Error as e:
+            print(f"Error search_cache put: {e}")
+
+    def refresh_later(self, qkey, query):
+        with self.lock:
+            if qkey in self.refreshing: return
+            self.refreshing.add(qkey)
+        background_pool.submit(self._refresh, qkey, query)
+
+    def _refresh(self, qkey, query):
+        try:
+            search_upstream(qkey, query)
+        except Exception as e:
+            print(f"Error search_cache refresh: {e}")
+        finally:
+            with self.lock:
+                self.refreshing.discard(qkey)
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE)
+
+class AudioCache:
+    # Cache byte audio di disk. Data ditulis ke file sparse {yt_id}.audio pakai pwrite,
+    # segmen baru dicatat di SQLite SETELAH fdatasync, jadi kalau crash index gak pernah
+    # ngaku punya data yang belum ada di disk.
+    FLUSH_EVERY = 16
+
+    def __init__(self, root, max_bytes, segment, policy):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.segment = segment
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.writers = {}
+
+    def path(self, yt_id):
+        return os.path.join(self.root, f"{yt_id}.audio")
+
+    def reconcile(self):
+        # Dipanggil sekali waktu startup: rapihin file yatim & row yang file-nya hilang
+        os.makedirs(self.root, exist_ok=True)
+        with get_db() as conn:
+            known = {r['yt_id'] for r in conn.execute('SELECT yt_id FROM audio_cache')}
+            on_disk = {name[:-len('.audio')] for name in os.listdir(self.root) if name.endswith('.audio')}
+            for yt_id in known - on_disk:
+                conn.execute('DELETE FROM audio_segments WHERE yt_id = ?', (yt_id,))
+                conn.execute('DELETE FROM audio_cache WHERE yt_id = ?', (yt_id,))
+        for yt_id in on_disk - known:
+            try: os.remove(self.path(yt_id))
+            except OSError: pass
+
+    def lookup(self, yt_id, byte_range, touch=True):
+        # -> dict(path, start, end, total, content_type, complete) kalau range-nya full ada di disk
+        now = time.time()
+        with get_db() as conn:
+            row = conn.execute('SELECT * FROM audio_cache WHERE yt_id = ?', (yt_id,)).fetchone()
+            if not row: return None
+            if touch:
+                conn.execute('UPDATE audio_cache SET hits = hits + 1, last_used = ? WHERE yt_id = ?', (now, yt_id))
+
+            total = row['total_size']
+            if byte_range is None: start, end = 0, total - 1
+            elif byte_range[0] is None: start, end = max(0, total - byte_range[1]), total - 1
+            else: start, end = byte_range[0], min(total - 1, byte_range[1] if byte_range[1] is not None else total - 1)
+            if start > end:
+                # Range lewat EOF: kalau file-nya lengkap, send_file yang jawab 416, gak usah ke upstream
+                if not row['complete']: return None
+                start, end = None, None
+
+            if not row['complete']:
+                first, last = start // self.segment, end // self.segment
+                run = 0
+                for (seg,) in conn.execute('SELECT seg FROM audio_segments WHERE yt_id = ? AND seg BETWEEN ? AND ? ORDER BY seg',
+                                           (yt_id, first, last)):
+                    if seg != first + run: break
+                    run += 1
+                open_ended = byte_range is not None and byte_range[0] is not None and byte_range[1] is None
+                if run == last - first + 1: pass
+                # "bytes=X-" yang baru sebagian ada: kirim bagian awal yang udah ada aja,
+                # player bakal minta sisanya sendiri (biar prefetch head langsung kepake)
+                elif open_ended and run: end = (first + run) * self.segment - 1
+                else: return None
+        return {'path': self.path(yt_id), 'start': start, 'end': end, 'total': total,
+                'content_type': row['content_type'], 'complete': bool(row['complete'])}
+
+    def writer(self, yt_id, offset, total, content_type):
+        if total <= 0 or total > AUDIO_CACHE_MAX_FILE: return None
+        try:
+            with get_db() as conn:
+                row = conn.execute('SELECT total_size FROM audio_cache WHERE yt_id = ?', (yt_id,)).fetchone()
+                if row and row['total_size'] != total:
+                    # Link baru ternyata format lain -> cache lama gak kepake
+                    self.drop(yt_id, conn)
+                    row = None
+                if not row:
+                    conn.execute('INSERT INTO audio_cache (yt_id, total_size, content_type, last_used) VALUES (?,?,?,?)',
+                                 (yt_id, total, content_type, time.time()))
+            fd = os.open(self.path(yt_id), os.O_RDWR | os.O_CREAT, 0o644)
+            if os.fstat(fd).st_size != total: os.ftruncate(fd, total)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error audio_cache writer: {e}")
+            return None
+        with self.lock:
+            self.writers[yt_id] = self.writers.get(yt_id, 0) + 1
+        return AudioWriter(self, yt_id, fd, offset, total)
+
+    def release(self, yt_id):
+        with self.lock:
+            self.writers[yt_id] -= 1
+            if not self.writers[yt_id]: del self.writers[yt_id]
+
+    def commit_segments(self, yt_id, segs, total):
+        nsegs = (total + self.segment - 1) // self.segment
+        with get_db() as conn:
+            if not conn.execute('SELECT 1 FROM audio_cache WHERE yt_id = ?', (yt_id,)).fetchone(): return
+            conn.executemany('INSERT OR IGNORE INTO audio_segments (yt_id, seg) VALUES (?,?)',
+                             [(yt_id, seg) for seg in segs])
+            have = conn.execute('SELECT COUNT(*) FROM audio_segments WHERE yt_id = ?', (yt_id,)).fetchone()[0]
+            conn.execute('UPDATE audio_cache SET cached_bytes = ?, complete = ? WHERE yt_id = ?',
+                         (min(total, have * self.segment), int(have >= nsegs), yt_id))
+
+    def drop(self, yt_id, conn):
+        conn.execute('DELETE FROM audio_segments WHERE yt_id = ?', (yt_id,))
+        conn.execute('DELETE FROM audio_cache WHERE yt_id = ?', (yt_id,))
+        try: os.remove(self.path(yt_id))
+        except OSError: pass
+
+    def evict(self):
+        order = 'hits ASC, last_used ASC' if self.policy == 'lfu' else 'last_used ASC'
+        with get_db() as conn:
+            used = conn.execute('SELECT COALESCE(SUM(cached_bytes), 0) FROM audio_cache').fetchone()[0]
+            if used <= self.max_bytes: return
+            with self.lock:
+                busy = set(self.writers)
+            for row in conn.execute(f'SELECT yt_id, cached_bytes FROM audio_cache ORDER BY {order}').fetchall():
+                if used <= self.max_bytes: break
+                if row['yt_id'] in busy: continue
+                self.drop(row['yt_id'], conn)
+                used -= row['cached_bytes']
+
+class AudioWriter:
+    # Nempel di generator proxy: tiap chunk yang lewat ditulis ke posisi absolutnya
+    def __init__(self, cache, yt_id, fd, offset, total):
+        self.cache = cache
+        self.yt_id = yt_id
+        self.fd = fd
+        self.start = self.pos = offset
+        self.total = total
+        self.pending = []
+        self.next_seg = -(-offset // cache.segment)  # segmen pertama yang ketulis utuh
+
+    def write(self, chunk):
+        if self.fd is None: return
+        try:
+            os.pwrite(self.fd, chunk, self.pos)
+        except OSError as e:
+            print(f"Error audio_cache write: {e}")
+            self.close()
+            return
+        self.pos += len(chunk)
+        seg_size = self.cache.segment
+        while (self.next_seg + 1) * seg_size <= self.pos or (
+                self.pos >= self.total and self.next_seg * seg_size < self.total):
+            self.pending.append(self.next_seg)
+            self.next_seg += 1
+        if len(self.pending) >= self.cache.FLUSH_EVERY: self.flush()
+
+    def flush(self):
+        if not self.pending or self.fd is None: return
+        try:
+            os.fdatasync(self.fd)
+            self.cache.commit_segments(self.yt_id, self.pending, self.total)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error audio_cache flush: {e}")
+        self.pending = []
+
+    def close(self):
+        if self.fd is None: return
+        self.flush()
+        os.close(self.fd)
+        self.fd = None
+        self.cache.release(self.yt_id)
+        try:
+            self.cache.evict()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error audio_cache evict: {e}")
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_SEGMENT, AUDIO_CACHE_POLICY)
+
+class ThumbCache:
+    # File kecil-kecil di disk: {yt_id}.src (cover asli) + {yt_id}.{w}.{fmt} (hasil resize).
+    # Urutan LRU & total ukuran dipegang di memori, di-seed dari mtime waktu startup.
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.files = OrderedDict()
+        self.used = 0
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def load(self):
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.root):
+            try:
+                if name.endswith('.tmp'):
+                    os.remove(self.path(name))
+                    continue
+                st = os.stat(self.path(name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        with self.lock:
+            for _, name, size in sorted(entries):
+                self.files[name] = size
+                self.used += size
+        self.evict()
+
+    def get(self, name):
+        with self.lock:
+            known = name in self.files
+            if known: self.files.move_to_end(name)
+        data = None
+        if known:
+            try:
+                with open(self.path(name), 'rb') as f:
+                    data = f.read()
+                os.utime(self.path(name))
+            except OSError:
+                with self.lock:
+                    self.used -= self.files.pop(name, 0)
+        metrics.inc('flinn_cache_requests_total', cache='thumb', result='hit' if data else 'miss')
+        return data
+
+    def put(self, name, data):
+        tmp = self.path(f"{name}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self.path(name))
+        except OSError as e:
+            print(f"Error thumb_cache put: {e}")
+            return
+        with self.lock:
+            self.used += len(data) - self.files.pop(name, 0)
+            self.files[name] = len(data)
+        self.evict()
+
+    def evict(self):
+        victims = []
+        with self.lock:
+            while self.used > self.max_bytes and len(self.files) > 1:
+                name, size = self.files.popitem(last=False)
+                self.used -= size
+                victims.append(name)
+        for name in victims:
+            try: os.remove(self.path(name))
+            except OSError: pass
+
+thumb_cache = ThumbCache(THUMB_DIR, THUMB_MAX_BYTES)
+
+class PrefixIndex:
+    # Array key (query ternormalisasi) yang selalu urut + bobot per key. Cari prefix =
+    # dua bisect, ranking = bobot terbesar. Kalau lewat max_terms, yang bobotnya paling
+    # kecil dibuang sampai tinggal 90%.
+    def __init__(self, max_terms):
+        self.max_terms = max_terms
+        self.keys = []
+        self.entries = {}  # key -> [bobot, teks asli]
+
+    def add(self, text, weight):
+        key = normalize_query(text or '')
+        if not key or len(key) > 120: return
+        entry = self.entries.get(key)
+        if entry:
+            entry[0] += weight
+            return
+        self.entries[key] = [weight, ' '.join(text.split())]
+        bisect.insort(self.keys, key)
+        if len(self.keys) > self.max_terms:
+            keep = heapq.nlargest(int(self.max_terms * 0.9), self.entries.items(), key=lambda kv: kv[1][0])
+            self.entries = dict(keep)
+            self.keys = sorted(self.entries)
+
+    def matches(self, prefix):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + '\uffff')
+        return self.keys[lo:hi]
+
+class SuggestIndex:
+    # Saran search-as-you-type tanpa nembak upstream sama sekali: dari query yang pernah
+    # sukses (bobot = berapa kali dicari) + judul & artis di library (dibangun ulang
+    # kalau versi library berubah; artis bobotnya = jumlah lagunya).
+    QUERY_WEIGHT = 2.0
+
+    def __init__(self, max_terms):
+        self.lock = threading.Lock()
+        self.queries = PrefixIndex(max_terms)
+        self.library = PrefixIndex(max_terms)
+        self.library_version = None
+
+    def seed(self):
+        # Startup: query lama diambil dari search_cache
+        with get_db() as conn:
+            rows = conn.execute('SELECT qkey FROM search_cache ORDER BY last_used DESC LIMIT ?',
+                                (self.queries.max_terms,)).fetchall()
+        with self.lock:
+            for row in rows:
+                self.queries.add(row['qkey'], self.QUERY_WEIGHT)
+
+    def record_query(self, query):
+        with self.lock:
+            self.queries.add(query, self.QUERY_WEIGHT)
+
+    def _sync_library(self):
+        with get_db() as conn:
+            version = conn.execute("SELECT value FROM library_meta WHERE key = 'version'").fetchone()[0]
+            if version == self.library_version: return
+            rows = conn.execute('SELECT title, artist FROM songs').fetchall()
+        library = PrefixIndex(self.library.max_terms)
+        for row in rows:
+            library.add(row['title'], 1.0)
+            library.add(row['artist'], 1.0)
+        with self.lock:
+            self.library, self.library_version = library, version
+
+    def suggest(self, text, limit):
+        prefix = normalize_query(text)
+        if not prefix: return []
+        try:
+            self._sync_library()
+        except sqlite3.Error as e:
+            print(f"Error suggest sync: {e}")
+
+        with self.lock:
+            scored = {}
+            for index in (self.queries, self.library):
+                for key in index.matches(prefix):
+                    weight, display = index.entries[key]
+                    if key in scored: scored[key][0] += weight
+                    else: scored[key] = [weight, display]
+        best = heapq.nlargest(limit, scored.items(), key=lambda kv: (kv[1][0], -len(kv[0])))
+        return [display for _, (_, display) in best]
+
+suggest_index = SuggestIndex(SUGGEST_MAX_TERMS)
+
+def call_instance(base, fetch, *args):
+    # Bungkus satu panggilan ke instance biar hasilnya kecatat di papan skor
+    start = time.monotonic()
+    try:
+        result = fetch(base, *args)
+    except Exception as e:
+        upstream_health.record_failure(base, e)
+        metrics.observe('flinn_upstream_request_seconds', time.monotonic() - start, instance=base)
+        metrics.inc('flinn_upstream_failures_total', instance=base, cause=failure_cause(e))
+        raise
+    latency = time.monotonic() - start
+    upstream_health.record_success(base, latency)
+    metrics.observe('flinn_upstream_request_seconds', latency, instance=base)
+    return result
+
+class TimedConnection(sqlite3.Connection):
+    # Tiap statement (plus commit di akhir `with`) dicatat ke histogram & Server-Timing 'db'
+    def _record(self, sql, start):
+        elapsed = time.perf_counter() - start
+        op = sql.lstrip().split(None, 1)[0].lower() if sql.strip() else 'other'
+        if op not in ('select', 'insert', 'update', 'delete', 'commit', 'pragma'): op = 'other'
+        metrics.observe('flinn_sqlite_query_seconds', elapsed, op=op)
+        add_timing('db', elapsed)
+
+    def execute(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            self._record(sql, start)
+
+    def executemany(self, sql, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            self._record(sql, start)
+
+    def __exit__(self, *exc):
+        # `with get_db() as conn` selesai = commit/rollback
+        start = time.perf_counter()
+        try:
+            return super().__exit__(*exc)
+        finally:
+            self._record('commit', start)
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    # Satu koneksi per thread, dipakai ulang terus. `with get_db() as conn` = satu transaksi
+    # (commit / rollback otomatis), koneksinya sendiri gak ditutup.
+    conn = getattr(db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT, factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        db_local.conn = conn
     return conn
 
+db_local = threading.local()
+
+# Skema versi-versian: index ke-N di list ini = PRAGMA user_version N+1. Tambah migrasi
+# baru di paling bawah, jangan ubah yang lama. Step bisa SQL atau fungsi(conn). Semua pakai IF NOT EXISTS biar DB lama
+# (yang dibikin sebelum ada user_version) aman dijalanin dari nol.
+MIGRATIONS = [
+    # 1: library
+    ["""CREATE TABLE IF NOT EXISTS songs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, 
+        title TEXT, artist TEXT, cover TEXT, 
+        duration TEXT, yt_id TEXT UNIQUE)"""],
+    # 2: cache link stream
+    ["""CREATE TABLE IF NOT EXISTS stream_cache (
+        yt_id TEXT PRIMARY KEY, url TEXT NOT NULL,
+        expires_at REAL NOT NULL, last_used REAL NOT NULL)""",
+     'CREATE INDEX IF NOT EXISTS idx_stream_cache_last_used ON stream_cache (last_used)'],
+    # 3: cache hasil search
+    ["""CREATE TABLE IF NOT EXISTS search_cache (
+        qkey TEXT PRIMARY KEY, results TEXT NOT NULL,
+        fetched_at REAL NOT NULL, last_used REAL NOT NULL)""",
+     'CREATE INDEX IF NOT EXISTS idx_search_cache_last_used ON search_cache (last_used)'],
+    # 4: index audio cache di disk
+    ["""CREATE TABLE IF NOT EXISTS audio_cache (
+        yt_id TEXT PRIMARY KEY, total_size INTEGER NOT NULL, content_type TEXT,
+        cached_bytes INTEGER NOT NULL DEFAULT 0, complete INTEGER NOT NULL DEFAULT 0,
+        hits INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL)""",
+     """CREATE TABLE IF NOT EXISTS audio_segments (
+        yt_id TEXT NOT NULL, seg INTEGER NOT NULL,
+        PRIMARY KEY (yt_id, seg)) WITHOUT ROWID"""],
+    # 5: versi library + changelog. Versi naik lewat trigger, jadi semua jalur insert/delete ketangkep
+    ["""CREATE TABLE IF NOT EXISTS library_meta (
+        key TEXT PRIMARY KEY, value INTEGER NOT NULL)""",
+     "INSERT OR IGNORE INTO library_meta (key, value) VALUES ('version', 0)",
+     """CREATE TABLE IF NOT EXISTS song_changes (
+        version INTEGER PRIMARY KEY, op TEXT NOT NULL,
+        song_id INTEGER NOT NULL, yt_id TEXT NOT NULL)"""] + [
+     f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON songs BEGIN
+        UPDATE library_meta SET value = value + 1 WHERE key = 'version';
+        INSERT INTO song_changes (version, op, song_id, yt_id)
+            VALUES ((SELECT value FROM library_meta WHERE key = 'version'), '{op}', {row}.id, {row}.yt_id);
+        DELETE FROM song_changes
+            WHERE version <= (SELECT value FROM library_meta WHERE key = 'version') - {LIBRARY_CHANGELOG_KEEP};
+    END""" for name, event, op, row in (('songs_changes_ai', 'INSERT', 'add', 'new'),
+                                        ('songs_changes_ad', 'DELETE', 'delete', 'old'))],
+    # 6: index buat query eviction audio cache (LRU / LFU)
+    ['CREATE INDEX IF NOT EXISTS idx_audio_cache_last_used ON audio_cache (last_used)',
+     'CREATE INDEX IF NOT EXISTS idx_audio_cache_hits ON audio_cache (hits, last_used)'],
+    # 7: full-text index judul + artis library (kalau SQLite-nya punya FTS5)
+    [lambda conn: create_songs_fts(conn)],
+    # 8: trigger changelog baca batasnya dari library_meta (versi 5 nge-bake angkanya ke SQL trigger)
+    ["DROP TRIGGER IF EXISTS songs_changes_ai",
+     "DROP TRIGGER IF EXISTS songs_changes_ad"] + [
+     f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON songs BEGIN
+        UPDATE library_meta SET value = value + 1 WHERE key = 'version';
+        INSERT INTO song_changes (version, op, song_id, yt_id)
+            VALUES ((SELECT value FROM library_meta WHERE key = 'version'), '{op}', {row}.id, {row}.yt_id);
+        DELETE FROM song_changes
+            WHERE version <= (SELECT value FROM library_meta WHERE key = 'version')
+                           - (SELECT value FROM library_meta WHERE key = 'changelog_keep');
+    END""" for name, event, op, row in (('songs_changes_ai', 'INSERT', 'add', 'new'),
+                                        ('songs_changes_ad', 'DELETE', 'delete', 'old'))],
+]
+
+def create_songs_fts(conn):
+    try:
+        conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts USING fts5(
+            title, artist, content='songs', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2')''')
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 gak tersedia, cari library pakai LIKE: {e}")
+        return
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS songs_fts_ai AFTER INSERT ON songs BEGIN
+        INSERT INTO songs_fts (rowid, title, artist) VALUES (new.id, new.title, new.artist);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS songs_fts_ad AFTER DELETE ON songs BEGIN
+        INSERT INTO songs_fts (songs_fts, rowid, title, artist) VALUES ('delete', old.id, old.title, old.artist);
+    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS songs_fts_au AFTER UPDATE ON songs BEGIN
+        INSERT INTO songs_fts (songs_fts, rowid, title, artist) VALUES ('delete', old.id, old.title, old.artist);
+        INSERT INTO songs_fts (rowid, title, artist) VALUES (new.id, new.title, new.artist);
+    END''')
+    conn.execute("INSERT INTO songs_fts (songs_fts) VALUES ('rebuild')")
+
 def init_db():
-    with get_db() as conn:
-        conn.execute('''CREATE TABLE IF NOT EXISTS songs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            title TEXT, artist TEXT, cover TEXT, 
-            duration TEXT, yt_id TEXT UNIQUE)''')
+    # Dipanggil sekali waktu startup. BEGIN IMMEDIATE biar kalau ada beberapa worker
+    # yang start barengan, migrasinya cuma jalan di satu.
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = conn.execute('PRAGMA user_version').fetchone()[0]
+        for version, statements in enumerate(MIGRATIONS[current:], start=current + 1):
+            for step in statements:
+                step(conn) if callable(step) else conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {version}')
+        conn.execute("INSERT OR REPLACE INTO library_meta (key, value) VALUES ('changelog_keep', ?)",
+                     (LIBRARY_CHANGELOG_KEEP,))
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def hedged_iter(instances, fetch, fanout, hedge_delay):
+    # Tembak instance satu-satu dengan jeda hedge_delay, maksimal `fanout` yang jalan barengan.
+    # Yield (instance, hasil) sesuai urutan selesainya; kalau generator-nya ditutup duluan,
+    # yang belum jalan dibatalin dan yang masih jalan dicuekin.
+    queue = list(instances)
+    pending = {}
+    next_launch = 0.0
+    try:
+        while queue or pending:
+            can_launch = queue and len(pending) < fanout
+            if can_launch and (not pending or time.monotonic() >= next_launch):
+                base = queue.pop(0)
+                pending[upstream_pool.submit(fetch, base)] = base
+                next_launch = time.monotonic() + hedge_delay
+                continue
+
+            timeout = max(0.0, next_launch - time.monotonic()) if can_launch else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                base = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception:
+                    result = None
+                # Yang gagal gak usah ditungguin hedge, langsung ganti instance berikutnya
+                if not result: next_launch = 0.0
+                yield base, result
+    finally:
+        for fut in pending: fut.cancel()
+
+def hedged_first(instances, fetch, fanout, hedge_delay):
+    # Hasil pertama yang gak kosong langsung dipakai
+    for _, result in hedged_iter(instances, fetch, fanout, hedge_delay):
+        if result: return result
+    return None
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.after_request
+def server_timing(resp):
+    # Response streaming (NDJSON, audio) kehitung sampai header-nya kekirim aja
+    total = time.perf_counter() - g.started
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in g.get('timings', {}).items()]
+    resp.headers['Server-Timing'] = ', '.join(parts + [f"total;dur={total * 1000:.1f}"])
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('flinn_http_request_seconds', total, route=route, method=request.method, status=resp.status_code)
+    return resp
+
+@app.route('/metrics')
+def prometheus_metrics():
+    with upstream_health.lock:
+        circuits = {base: int(st['open_until'] > 0) for base, st in upstream_health.stats.items()}
+    for base, is_open in circuits.items():
+        metrics.set('flinn_upstream_circuit_open', is_open, instance=base)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class CompressedAsset:
+    # Body statis yang dikompres sekali di awal (gzip, + brotli kalau modulnya ada),
+    # dilayani pakai ETag kuat + Cache-Control panjang. ETag kuat harus sama persis per byte,
+    # jadi tiap encoding dapat suffix sendiri; If-None-Match boleh nyebut yang mana aja.
+    SUFFIXES = {None: '', 'gzip': '-gz', 'br': '-br'}
+
+    def __init__(self, body, content_type, cache_control):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = self.etag_for(None)
+        self.variants = {'gzip': gzip.compress(self.body, 9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body, quality=11)
+
+    def etag_for(self, encoding):
+        return f'"{self.digest}{self.SUFFIXES[encoding]}"'
+
+    def response(self):
+        accepted = request.accept_encodings
+        encoding = next((e for e in ('br', 'gzip') if e in self.variants and accepted[e]), None)
+        headers = {'ETag': self.etag_for(encoding), 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+        if_none_match = request.headers.get('If-None-Match', '')
+        if any(self.etag_for(e) in if_none_match for e in self.SUFFIXES):
+            return Response(status=304, headers=headers)
+
+        body = self.variants[encoding] if encoding else self.body
+        if encoding: headers['Content-Encoding'] = encoding
+        headers['Content-Length'] = str(len(body))
+        return Response(body, content_type=self.content_type, headers=headers)
 
 @app.route('/')
 def index():
-    init_db()
-    return render_template_string(HTML_TEMPLATE)
+    return app_shell.response()
+
+@app.route('/sw.js')
+def service_worker():
+    resp = service_worker_asset.response()
+    resp.headers['Service-Worker-Allowed'] = '/'
+    return resp
+
+@app.route('/assets/app.<digest>.css')
+def app_css(digest):
+    if digest != APP_CSS_DIGEST: return jsonify({"error": "not found"}), 404
+    return app_css_asset.response()
 
 @app.route('/api/content')
 def get_content():
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', type=int)
+
     with get_db() as conn:
-        songs = conn.execute('SELECT * FROM songs ORDER BY id DESC').fetchall()
-        return jsonify({"songs": [dict(s) for s in songs]})
+        version = conn.execute("SELECT value FROM library_meta WHERE key = 'version'").fetchone()[0]
+        # Isi respons cuma bergantung ke URL + versi library, jadi versi = ETag
+        etag = f'"lib-{version}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+        if since is not None:
+            data = library_delta(conn, since, version)
+        else:
+            data = {"version": version}
+            if limit:
+                limit = min(max(1, limit), LIBRARY_PAGE_MAX)
+                songs = conn.execute('SELECT * FROM songs WHERE id < ? ORDER BY id DESC LIMIT ?',
+                                     (cursor if cursor is not None else 2 ** 63 - 1, limit)).fetchall()
+                data["next_cursor"] = songs[-1]['id'] if len(songs) == limit else None
+            else:
+                songs = conn.execute('SELECT * FROM songs ORDER BY id DESC').fetchall()
+            data["songs"] = [dict(s) for s in songs]
+
+    resp = jsonify(data)
+    resp.headers['ETag'] = etag
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+def library_delta(conn, since, version):
+    # Lagu yang ditambah / dihapus setelah versi `since`. Kalau changelog-nya udah
+    # kepangkas (atau versinya aneh) client disuruh reset & ambil ulang semua.
+    oldest = conn.execute('SELECT MIN(version) FROM song_changes').fetchone()[0]
+    if since > version or (since < version and (oldest is None or oldest > since + 1)):
+        return {"version": version, "reset": True}
+
+    latest = {}
+    for row in conn.execute('SELECT op, yt_id FROM song_changes WHERE version > ? ORDER BY version', (since,)):
+        latest[row['yt_id']] = row['op']
+    added_ids = [yt_id for yt_id, op in latest.items() if op == 'add']
+    added = []
+    for i in range(0, len(added_ids), 500):
+        chunk = added_ids[i:i + 500]
+        added += conn.execute(f"SELECT * FROM songs WHERE yt_id IN ({','.join('?' * len(chunk))}) ORDER BY id DESC",
+                              chunk).fetchall()
+    present = {s['yt_id'] for s in added}
+    deleted = [yt_id for yt_id in latest if yt_id not in present]
+    return {"version": version, "added": [dict(s) for s in added], "deleted": deleted}
 
 @app.route('/api/add', methods=['POST'])
 def add_song():
@@ -39,12 +1440,7 @@ def add_song():
             # Pastikan field yang wajib ada tidak kosong
             if not s.get('yt_id'): return jsonify({"status": "error"}), 400
             
-            conn.execute('INSERT OR IGNORE INTO songs (title, artist, cover, duration, yt_id) VALUES (?,?,?,?,?)',
-                         (s.get('title', 'Unknown Title'), 
-                          s.get('artist', 'Unknown Artist'), 
-                          s.get('cover'), 
-                          s.get('duration', '0:00'), 
-                          s.get('yt_id')))
+            conn.execute(INSERT_SONG_SQL, song_row(s))
             conn.commit()
         return jsonify({"status": "success"})
     except Exception as e:
@@ -61,84 +1457,866 @@ def delete_song(yt_id):
     except:
         return jsonify({"status": "error"}), 500
 
+INSERT_SONG_SQL = 'INSERT OR IGNORE INTO songs (title, artist, cover, duration, yt_id) VALUES (?,?,?,?,?)'
+
+def song_row(s):
+    return (s.get('title', 'Unknown Title'), 
+            s.get('artist', 'Unknown Artist'), 
+            s.get('cover'), 
+            s.get('duration', '0:00'), 
+            s.get('yt_id'))
+
+@app.route('/api/library/batch', methods=['POST'])
+def library_batch():
+    # Banyak add + delete sekaligus dalam SATU transaksi
+    body = request.json or {}
+    adds = body.get('add') or []
+    deletes = body.get('delete') or []
+    if not isinstance(adds, list) or not isinstance(deletes, list):
+        return jsonify({"status": "error"}), 400
+    rows = [song_row(s) for s in adds if isinstance(s, dict) and s.get('yt_id')]
+    delete_ids = [(yt_id,) for yt_id in deletes if isinstance(yt_id, str) and yt_id]
+
+    try:
+        with get_db() as conn:
+            # rowcount executemany = jumlah baris songs yang kena (trigger gak ikut dihitung)
+            added = conn.executemany(INSERT_SONG_SQL, rows).rowcount if rows else 0
+            deleted = conn.executemany('DELETE FROM songs WHERE yt_id = ?', delete_ids).rowcount if delete_ids else 0
+    except sqlite3.Error as e:
+        print(f"Error library_batch: {e}")
+        return jsonify({"status": "error"}), 500
+    return jsonify({"status": "success", "added": added, "deleted": deleted})
+
+PLAYLIST_ID_RE = re.compile(r'[?&]list=([\w-]+)')
+
+@app.route('/api/library/import', methods=['POST'])
+def library_import():
+    # Tarik playlist Piped halaman per halaman, tiap halaman langsung masuk library
+    # (satu transaksi per halaman) dan progress-nya dikirim sebagai NDJSON
+    playlist = ((request.json or {}).get('playlist') or '').strip()
+    m = PLAYLIST_ID_RE.search(playlist)
+    playlist_id = m.group(1) if m else playlist
+    if not re.fullmatch(r'[\w-]+', playlist_id or ''):
+        return jsonify({"status": "error", "error": "Playlist gak valid"}), 400
+
+    def generate():
+        fetched = imported = 0
+        for page, songs in enumerate(playlist_pages(playlist_id), start=1):
+            if isinstance(songs, Exception):
+                yield json.dumps({"status": "error", "error": str(songs), "fetched": fetched, "imported": imported}) + '\n'
+                return
+            try:
+                with get_db() as conn:
+                    if songs: imported += conn.executemany(INSERT_SONG_SQL, [song_row(s) for s in songs]).rowcount
+            except sqlite3.Error as e:
+                print(f"Error library_import: {e}")
+                yield json.dumps({"status": "error", "error": "Gagal nyimpen ke library", "fetched": fetched, "imported": imported}) + '\n'
+                return
+            fetched += len(songs)
+            yield json.dumps({"status": "progress", "page": page, "fetched": fetched, "imported": imported}) + '\n'
+        yield json.dumps({"status": "done", "fetched": fetched, "imported": imported}) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def playlist_pages(playlist_id):
+    # Yield list lagu per halaman; kalau semua instance gagal yield exception-nya lalu berhenti
+    nextpage = None
+    for _ in range(IMPORT_MAX_PAGES):
+        try:
+            data = flights.do(('playlist', playlist_id, nextpage), fetch_playlist_page, playlist_id, nextpage)
+        except UpstreamError as e:
+            yield e
+            return
+        yield [song for song in map(playlist_song, data.get('relatedStreams') or []) if song]
+        nextpage = data.get('nextpage')
+        if not nextpage: return
+
+def fetch_playlist_page(playlist_id, nextpage):
+    for base in upstream_health.ranked(STREAM_INSTANCES):
+        try:
+            data = call_instance(base, playlist_instance, playlist_id, nextpage)
+        except Exception:
+            continue
+        if data is not None: return data
+    raise UpstreamError("Semua server Piped sibuk")
+
+def playlist_instance(base, playlist_id, nextpage):
+    if nextpage:
+        res = upstream.get(f"{base}/nextpage/playlists/{playlist_id}", params={'nextpage': nextpage})
+    else:
+        res = upstream.get(f"{base}/playlists/{playlist_id}")
+    if not instance_ok(res): return None
+    return res.json()
+
+def playlist_song(item):
+    # Item playlist Piped -> baris songs. url-nya bentuk "/watch?v=<id>"
+    v_id = parse_qs(urlparse(item.get('url') or '').query).get('v', [None])[0]
+    if not v_id: return None
+    seconds = item.get('duration') or 0
+    return {
+        "title": item.get('title') or 'Unknown Title',
+        "artist": item.get('uploaderName') or 'Unknown Artist',
+        "cover": item.get('thumbnail'),
+        "duration": f"{seconds // 60}:{seconds % 60:02d}" if isinstance(seconds, int) and seconds > 0 else '0:00',
+        "yt_id": v_id,
+    }
+
+# Video id YouTube selalu 11 karakter. Dicek sebelum jadi path ke Piped & key flight / cache,
+# biar satu request gak bisa nyuruh kita nembak path sembarang ke tiap instance.
+YT_ID_RE = re.compile(r'[A-Za-z0-9_-]{11}')
+
+def valid_yt_id(yt_id):
+    return isinstance(yt_id, str) and YT_ID_RE.fullmatch(yt_id) is not None
+
 @app.route('/api/stream/<yt_id>')
 def stream(yt_id):
-    # Daftar server buat ambil link audio
-    stream_instances = [
-        'https://pipedapi.kavin.rocks',
-        'https://pipedapi.lcom.cloud',
-        'https://pipedapi.mha.fi',
-        'https://pipedapi.drgns.space'
-    ]
-    
-    for base in stream_instances:
+    if not valid_yt_id(yt_id): return jsonify({"error": "yt_id gak valid"}), 400
+    try:
+        url = get_stream_url(yt_id)
+    except UpstreamError as e:
+        return jsonify({"error": str(e)}), 500
+    data = {"url": url}
+    if AUDIO_PROXY: data["proxy"] = f"/api/stream/{yt_id}/audio"
+    return jsonify(data)
+
+def get_stream_url(yt_id):
+    return stream_cache.get(yt_id) or flights.do(('stream', yt_id), resolve_stream, yt_id)
+
+def resolve_stream(yt_id):
+    for base in upstream_health.ranked(STREAM_INSTANCES):
         try:
-            res = requests.get(f"{base}/streams/{yt_id}", timeout=5)
-            if res.status_code == 200:
-                data = res.json()
-                audio_streams = data.get('audioStreams', [])
-                if audio_streams:
-                    # Ambil yang formatnya m4a atau yang pertama
-                    return jsonify({"url": audio_streams[0]['url']})
-        except:
+            url = call_instance(base, stream_instance, yt_id)
+        except Exception:
             continue
-            
-    return jsonify({"error": "Semua server Piped sibuk"}), 500
-    
+        if url:
+            stream_cache.put(yt_id, url)
+            return url
+
+    if YTDLP_FALLBACK:
+        try:
+            url = ytdlp_resolver.resolve(yt_id)
+        except UpstreamError as e:
+            print(f"Error ytdlp resolve {yt_id}: {e}")
+        else:
+            stream_cache.put(yt_id, url)
+            return url
+    raise UpstreamError("Semua server Piped sibuk")
+
+def stream_instance(base, yt_id):
+    res = upstream.get(f"{base}/streams/{yt_id}", read_timeout=5)
+    if not instance_ok(res): return None
+    return audio_url(res.json())
+
+def audio_url(data):
+    audio_streams = data.get('audioStreams', [])
+    if audio_streams:
+        # Ambil yang formatnya m4a atau yang pertama
+        return audio_streams[0]['url']
+    return None
+
+@app.route('/api/stream/batch', methods=['POST'])
+def stream_batch():
+    ids = (request.json or {}).get('ids') or []
+    if not isinstance(ids, list): return jsonify({"status": "error"}), 400
+    ids = list(dict.fromkeys(i for i in ids if valid_yt_id(i)))[:BATCH_MAX_IDS]
+
+    # Default NDJSON (satu baris per lagu, dikirim begitu selesai); ?stream=0 -> satu JSON map
+    if request.args.get('stream') == '0':
+        return jsonify({"results": {item.pop('yt_id'): item for item in resolve_batch(ids)}})
+    return Response((json.dumps(item) + '\n' for item in resolve_batch(ids)), mimetype='application/x-ndjson')
+
+def batch_item(yt_id):
+    try:
+        url = get_stream_url(yt_id)
+    except UpstreamError as e:
+        return {"yt_id": yt_id, "status": "error", "error": str(e)}
+    return {"yt_id": yt_id, "status": "ok", "url": url, "expires_at": int(stream_expiry(url))}
+
+def resolve_batch(ids):
+    # Yang udah ada di cache langsung keluar, sisanya di-resolve paralel
+    # maksimal BATCH_PARALLELISM per request
+    queue = []
+    for yt_id in ids:
+        url = stream_cache.get(yt_id)
+        if url: yield {"yt_id": yt_id, "status": "ok", "url": url, "expires_at": int(stream_expiry(url))}
+        else: queue.append(yt_id)
+
+    pending = set()
+    while queue or pending:
+        while queue and len(pending) < BATCH_PARALLELISM:
+            pending.add(batch_pool.submit(batch_item, queue.pop(0)))
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            yield fut.result()
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+def parse_range(header):
+    # "bytes=100-" -> (100, None), "bytes=-500" -> (None, 500) ; multi-range gak didukung
+    m = RANGE_RE.match((header or '').strip())
+    if not m or m.group(1) == m.group(2) == '': return None
+    if m.group(1) == '': return None, int(m.group(2))
+    return int(m.group(1)), (int(m.group(2)) if m.group(2) else None)
+
+def range_header(start, end):
+    if start is None: return f"bytes=-{end}"
+    return f"bytes={start}-{'' if end is None else end}"
+
+def open_audio(yt_id, byte_range, method='GET'):
+    # Buka koneksi ke googlevideo; kalau link-nya udah ditolak (expired / IP-locked)
+    # buang dari cache terus resolve ulang sekali
+    headers = {'Range': range_header(*byte_range)} if byte_range else None
+    for attempt in range(2):
+        url = get_stream_url(yt_id)
+        res = upstream.request(method, url, headers=headers, stream=True, read_timeout=AUDIO_READ_TIMEOUT)
+        if res.status_code in (401, 403, 404, 410) and attempt == 0:
+            res.close()
+            stream_cache.invalidate(yt_id)
+            continue
+        if res.status_code not in (200, 206, 416):
+            res.close()
+            raise UpstreamError(f"Audio upstream HTTP {res.status_code}")
+        return res
+
+def serve_cached_audio(hit):
+    # Semua lewat send_file (wsgi.file_wrapper / sendfile), Range & 416 diurus Werkzeug.
+    # File yang belum lengkap: Range-nya diganti ke bagian yang beneran udah ada di disk (hasil lookup).
+    environ = request.environ
+    if not hit['complete']:
+        environ = dict(environ, HTTP_RANGE=range_header(hit['start'], hit['end']))
+        environ.pop('HTTP_IF_RANGE', None)
+    resp = werkzeug_send_file(hit['path'], environ, mimetype=hit['content_type'] or 'audio/mp4',
+                              conditional=True, etag=False, response_class=app.response_class)
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@app.route('/api/stream/<yt_id>/audio')
+def stream_audio(yt_id):
+    if not valid_yt_id(yt_id): return jsonify({"error": "yt_id gak valid"}), 400
+    byte_range = parse_range(request.headers.get('Range'))
+    if AUDIO_CACHE:
+        try:
+            hit = audio_cache.lookup(yt_id, byte_range)
+        except sqlite3.Error as e:
+            print(f"Error audio_cache lookup: {e}")
+            hit = None
+        if hit and os.path.exists(hit['path']):
+            metrics.inc('flinn_cache_requests_total', cache='audio', result='hit')
+            return serve_cached_audio(hit)
+        metrics.inc('flinn_cache_requests_total', cache='audio', result='miss')
+
+    # HEAD cukup diterusin jadi HEAD ke upstream, gak usah buka body GET
+    head = request.method == 'HEAD'
+    try:
+        res = open_audio(yt_id, byte_range, 'HEAD' if head else 'GET')
+    except (UpstreamError, requests.RequestException) as e:
+        return jsonify({"error": str(e)}), 502
+
+    if res.status_code == 416:
+        res.close()
+        return Response(status=416, headers={'Content-Range': res.headers.get('Content-Range', 'bytes */*')})
+
+    # Posisi absolut bagian yang dikirim, biar bisa lanjut dari byte yang sama kalau putus
+    m = CONTENT_RANGE_RE.match(res.headers.get('Content-Range', ''))
+    if res.status_code == 206 and m:
+        first, last = int(m.group(1)), int(m.group(2))
+    else:
+        first, last = 0, None
+    length = res.headers.get('Content-Length')
+    if last is None and length:
+        last = first + int(length) - 1
+    # Upstream nyuekin Range dan ngirim full file -> byte depannya kita buang sendiri
+    skip = byte_range[0] if res.status_code == 200 and byte_range and byte_range[0] else 0
+
+    content_type = res.headers.get('Content-Type', 'audio/mp4')
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Type': content_type,
+        'Cache-Control': 'no-store',
+    }
+    status = 200
+    total = None
+    if m and m.group(3) != '*': total = int(m.group(3))
+    elif res.status_code == 200 and last is not None: total = last + 1
+    if res.status_code == 206 or skip:
+        status = 206
+        headers['Content-Range'] = f"bytes {first + skip}-{last}/{total if total is not None else '*'}"
+    if last is not None:
+        headers['Content-Length'] = str(last - first - skip + 1)
+    if head:
+        res.close()
+        return Response(status=status, headers=headers)
+
+    def generate(res):
+        # Writer baru dibuka di sini: generator yang gak pernah mulai (client putus sebelum
+        # chunk pertama) ditutup Werkzeug tanpa pernah nyampe finally di bawah
+        writer = audio_cache.writer(yt_id, first, total, content_type) if AUDIO_CACHE and total else None
+        sent = 0
+        resumes = 0
+        try:
+            while True:
+                try:
+                    for chunk in res.iter_content(AUDIO_CHUNK_SIZE):
+                        if writer: writer.write(chunk)
+                        if skip > sent:
+                            cut = min(len(chunk), skip - sent)
+                            sent += cut
+                            chunk = chunk[cut:]
+                            if not chunk: continue
+                        sent += len(chunk)
+                        yield chunk
+                except requests.RequestException as e:
+                    print(f"Error stream_audio {yt_id} @ {first + sent}: {e}")
+                finally:
+                    res.close()
+
+                if last is None or first + sent > last or resumes >= AUDIO_PROXY_RESUMES: return
+                # Putus / expired di tengah lagu: resolve ulang terus lanjut dari offset terakhir
+                resumes += 1
+                try:
+                    res = open_audio(yt_id, (first + sent, last))
+                except (UpstreamError, requests.RequestException) as e:
+                    print(f"Error stream_audio resume {yt_id}: {e}")
+                    return
+                m2 = CONTENT_RANGE_RE.match(res.headers.get('Content-Range', ''))
+                if res.status_code != 206 or not m2 or (total and m2.group(3) != str(total)):
+                    res.close()
+                    return
+        finally:
+            if writer: writer.close()
+
+    resp = Response(generate(res), status=status, headers=headers, direct_passthrough=True)
+    # Sama alasannya: koneksi upstream pertama tetap dibalikin walau body-nya gak pernah diminta
+    resp.call_on_close(res.close)
+    return resp
+
+THUMB_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png', 'gif': 'image/gif'}
+
+@app.route('/api/thumb/<yt_id>')
+def thumb(yt_id):
+    if not valid_yt_id(yt_id): return jsonify({"error": "yt_id gak valid"}), 400
+    wanted = request.args.get('w', type=int) or THUMB_SIZES[0]
+    width = next((w for w in THUMB_SIZES if w >= wanted), THUMB_SIZES[-1])
+    fmt = 'webp' if THUMB_WEBP and 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    try:
+        if Image is None:
+            data = thumb_source(yt_id)
+            fmt = image_format(data)
+        else:
+            name = f"{yt_id}.{width}.{fmt}"
+            data = thumb_cache.get(name) or flights.do(('thumb', name), make_thumb, yt_id, width, fmt)
+    except UpstreamError as e:
+        return jsonify({"error": str(e)}), 404
+
+    headers = {'Cache-Control': 'public, max-age=31536000, immutable', 'Vary': 'Accept'}
+    return Response(data, content_type=THUMB_TYPES.get(fmt, 'application/octet-stream'), headers=headers)
+
+def thumb_source(yt_id):
+    return thumb_cache.get(f"{yt_id}.src") or flights.do(('thumb', yt_id), fetch_thumb_source, yt_id)
+
+def fetch_thumb_source(yt_id):
+    # Cover dari library duluan (yang emang keliatan di UI), kalau gak ada pakai mqdefault
+    # dari i.ytimg.com: 16:9 tanpa letterbox, udah cukup buat ukuran thumbnail
+    urls = []
+    with get_db() as conn:
+        row = conn.execute('SELECT cover FROM songs WHERE yt_id = ?', (yt_id,)).fetchone()
+    if row and row['cover'] and thumb_host_allowed(row['cover']): urls.append(row['cover'])
+    urls.append(f"https://i.ytimg.com/vi/{yt_id}/mqdefault.jpg")
+
+    for url in urls:
+        try:
+            # Redirect gak diikutin: bisa aja host yang diizinin ngelempar ke alamat internal
+            res = upstream.get(url, read_timeout=5, stream=True, allow_redirects=False)
+        except requests.RequestException as e:
+            print(f"Error thumb fetch: {e}")
+            continue
+        with res:
+            if res.status_code != 200: continue
+            data = res.raw.read(THUMB_SOURCE_MAX + 1, decode_content=True)
+        if not data or len(data) > THUMB_SOURCE_MAX or not image_format(data): continue
+        thumb_cache.put(f"{yt_id}.src", data)
+        return data
+    raise UpstreamError("Cover gak ketemu")
+
+def thumb_host_allowed(url):
+    # Cover itu input user (/api/add), jadi jangan sampai server disuruh nge-fetch alamat sembarang
+    parts = urlparse(url)
+    host = (parts.hostname or '').lower()
+    if parts.scheme != 'https' or not host: return False
+    if host in THUMB_HOSTS: return True
+    try:
+        ipaddress.ip_address(host)
+        return False
+    except ValueError:
+        pass
+    for base in STREAM_INSTANCES + SEARCH_INSTANCES:
+        labels = (urlparse(base).hostname or '').lower().split('.')
+        if len(labels) >= 3 and host.endswith('.' + '.'.join(labels[1:])): return True
+    return False
+
+def image_format(data):
+    if data[:3] == b'\xff\xd8\xff': return 'jpeg'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP': return 'webp'
+    if data[:8] == b'\x89PNG\r\n\x1a\n': return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'): return 'gif'
+    return None
+
+def make_thumb(yt_id, width, fmt):
+    src = thumb_source(yt_id)
+    try:
+        img = Image.open(io.BytesIO(src))
+        img.draft('RGB', (width, width))  # JPEG: decode langsung di skala kecil
+        img = ImageOps.fit(img.convert('RGB'), (width, width), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'WEBP' if fmt == 'webp' else 'JPEG', quality=THUMB_QUALITY, optimize=True)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Error thumb resize: {e}")
+        raise UpstreamError("Cover gak bisa diproses")
+    data = out.getvalue()
+    thumb_cache.put(f"{yt_id}.{width}.{fmt}", data)
+    return data
+
+prefetching = set()
+prefetch_lock = threading.Lock()
+
+@app.route('/api/prefetch', methods=['POST'])
+def prefetch():
+    ids = (request.json or {}).get('ids') or []
+    if not isinstance(ids, list): return jsonify({"status": "error"}), 400
+
+    queued = []
+    for yt_id in ids[:PREFETCH_MAX]:
+        if not valid_yt_id(yt_id): continue
+        with prefetch_lock:
+            if yt_id in prefetching: continue
+            prefetching.add(yt_id)
+        prefetch_pool.submit(warm_track, yt_id)
+        queued.append(yt_id)
+    return jsonify({"status": "queued", "ids": queued}), 202
+
+def warm_track(yt_id):
+    # Jalan di prefetch_pool: resolve link + (kalau ada audio cache) tarik byte awalnya
+    try:
+        get_stream_url(yt_id)
+        if AUDIO_CACHE: warm_audio_head(yt_id)
+    except Exception as e:
+        print(f"Error prefetch {yt_id}: {e}")
+    finally:
+        with prefetch_lock:
+            prefetching.discard(yt_id)
+
+def warm_audio_head(yt_id):
+    head = (0, PREFETCH_HEAD_BYTES - 1)
+    if audio_cache.lookup(yt_id, head, touch=False): return
+
+    res = open_audio(yt_id, head)
+    try:
+        m = CONTENT_RANGE_RE.match(res.headers.get('Content-Range', ''))
+        if res.status_code != 206 or not m or m.group(3) == '*': return
+        writer = audio_cache.writer(yt_id, int(m.group(1)), int(m.group(3)), res.headers.get('Content-Type', 'audio/mp4'))
+        if not writer: return
+        try:
+            for chunk in res.iter_content(AUDIO_CHUNK_SIZE):
+                writer.write(chunk)
+        finally:
+            writer.close()
+    finally:
+        res.close()
+
 @app.route('/api/search')
 def search():
     query = request.args.get('q')
     if not query: return jsonify({"content": []})
 
-    # Daftar server Piped yang lebih luas dan terbaru
-    search_instances = [
-        'https://pipedapi.kavin.rocks',
-        'https://pipedapi.lcom.cloud',
-        'https://pipedapi.mha.fi',
-        'https://pipedapi.leptons.xyz',
-        'https://pipedapi.astoria.ws',
-        'https://pipedapi.demover.me',
-        'https://pipedapi.rivo.lol'
-    ]
+    qkey = normalize_query(query)
+    if not qkey: return jsonify({"content": []})
+
+    # Lagu yang udah ada di library ditaruh paling atas (?library=0 buat matiin)
+    local = [library_result(s) for s in search_library(qkey, LIBRARY_SEARCH_MERGE)] \
+        if request.args.get('library') != '0' else []
 
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/121.0.0.0'}
+    if request.args.get('stream') == '1':
+        return Response((json.dumps(batch) + '\n' for batch in search_batches(qkey, query, local)),
+                        mimetype='application/x-ndjson')
 
-    for base in search_instances:
+    results, is_stale = search_cache.get(qkey)
+    if results is not None:
+        if is_stale: search_cache.refresh_later(qkey, query)
+    else:
         try:
-            # Kita cari secara general (tanpa filter music) biar hasilnya PASTI keluar
-            url = f"{base}/search?q={query}" 
-            res = requests.get(url, headers=headers, timeout=4)
-
-            if res.status_code == 200:
-                data = res.json()
-                # Piped kadang ngasih 'content', kadang 'items'
-                items = data.get('content') or data.get('items') or []
-                
-                if not items: continue
-
-                results = []
-                for item in items:
-                    v_id = item.get('videoId')
-                    if v_id:
-                        # Ambil thumbnail yang tersedia
-                        thumb = item.get('thumbnail')
-                        if isinstance(thumb, list) and len(thumb) > 0:
-                            thumb = thumb[-1].get('url')
-
-                        results.append({
-                            "title": item.get('title', 'Unknown'),
-                            "uploaderName": item.get('uploaderName', 'Unknown'),
-                            "thumbnail": thumb,
-                            "videoId": v_id,
-                            "duration": item.get('duration', 0)
-                        })
-                
-                if results:
-                    return jsonify({"content": results})
-        except:
-            continue
+            results = search_upstream(qkey, query)
+        except UpstreamError:
+            results = []
+    if results: suggest_index.record_query(query)
+    return jsonify({"content": merge_results(local, results)})
+
+def search_batches(qkey, query, local):
+    # Versi streaming /api/search: tiap sumber (library, cache, tiap instance Piped) langsung
+    # dikirim begitu jawab. Item yang videoId-nya udah pernah dikirim gak diulang.
+    seen = set()
+
+    def fresh(items):
+        out = [item for item in items if item['videoId'] not in seen]
+        seen.update(item['videoId'] for item in out)
+        return out
+
+    if local: yield {"source": "library", "content": fresh(local)}
+
+    results, is_stale = search_cache.get(qkey)
+    if results is not None:
+        if is_stale: search_cache.refresh_later(qkey, query)
+        if results: suggest_index.record_query(query)
+        yield {"source": "cache", "content": fresh(results)}
+        yield {"done": True}
+        return
+
+    # Cache miss: request barengan buat qkey yang sama cuma bikin satu fan-out
+    for base, items in search_flights.iter(('search', qkey), search_remote, qkey, query):
+        new = fresh(items)
+        if new: yield {"source": urlparse(base).hostname, "content": new}
+    yield {"done": True}
+
+def search_remote(qkey, query):
+    # Producer BatchFlight: yield (instance, items) tiap instance yang jawab, sampai
+    # SEARCH_STREAM_SOURCES. Gabungannya masuk search cache.
+    remote = []
+    answered = 0
+    for base, items in hedged_iter(upstream_health.ranked(SEARCH_INSTANCES),
+                                   lambda base: call_instance(base, search_instance, query),
+                                   SEARCH_FANOUT, SEARCH_HEDGE_DELAY):
+        if not items: continue
+        remote += items
+        yield base, items
+        answered += 1
+        if answered >= SEARCH_STREAM_SOURCES: break
+
+    if remote:
+        search_cache.put(qkey, merge_results(remote))
+        suggest_index.record_query(query)
+
+@app.route('/api/suggest')
+def suggest():
+    q = request.args.get('q') or ''
+    limit = min(max(1, request.args.get('limit', 8, type=int)), 20)
+    return jsonify({"suggestions": suggest_index.suggest(q, limit)})
+
+def merge_results(*batches):
+    seen = set()
+    merged = []
+    for batch in batches:
+        for item in batch:
+            if item['videoId'] in seen: continue
+            seen.add(item['videoId'])
+            merged.append(item)
+    return merged
+
+@app.route('/api/library/search')
+def library_search():
+    qkey = normalize_query(request.args.get('q') or '')
+    limit = min(max(1, request.args.get('limit', 20, type=int)), 100)
+    if not qkey: return jsonify({"songs": []})
+    return jsonify({"songs": [dict(s) for s in search_library(qkey, limit)]})
+
+def search_library(qkey, limit):
+    # FTS5 + prefix match tiap kata ("taylor sw" -> "taylor"* "sw"*), diurutin bm25
+    # (judul bobotnya 2x artis). Kalau FTS5 gak ada, jatuh ke LIKE.
+    terms = qkey.split()
+    if not terms: return []
+    try:
+        with get_db() as conn:
+            try:
+                match = ' '.join('"' + t.replace('"', '""') + '"*' for t in terms)
+                return conn.execute('''SELECT songs.* FROM songs_fts JOIN songs ON songs.id = songs_fts.rowid
+                    WHERE songs_fts MATCH ? ORDER BY bm25(songs_fts, 2.0, 1.0) LIMIT ?''', (match, limit)).fetchall()
+            except sqlite3.OperationalError:
+                where = ' AND '.join(["(title LIKE ? OR artist LIKE ?)"] * len(terms))
+                params = [p for t in terms for p in (f"%{t}%", f"%{t}%")]
+                return conn.execute(f'SELECT * FROM songs WHERE {where} ORDER BY id DESC LIMIT ?',
+                                    params + [limit]).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error search_library: {e}")
+        return []
+
+def library_result(s):
+    # Baris songs -> bentuk hasil search Piped
+    try:
+        minutes, seconds = (s['duration'] or '').split(':')
+        duration = int(minutes) * 60 + int(seconds)
+    except ValueError:
+        duration = -1
+    return {
+        "title": s['title'] or 'Unknown',
+        "uploaderName": s['artist'] or 'Unknown',
+        "thumbnail": s['cover'],
+        "videoId": s['yt_id'],
+        "duration": duration,
+        "inLibrary": True
+    }
+
+def search_upstream(qkey, query):
+    return flights.do(('search', qkey), _search_upstream, qkey, query)
+
+def _search_upstream(qkey, query):
+    results = hedged_first(upstream_health.ranked(SEARCH_INSTANCES),
+                           lambda base: call_instance(base, search_instance, query),
+                           SEARCH_FANOUT, SEARCH_HEDGE_DELAY)
+    if not results: raise UpstreamError("Gak ada instance yang ngasih hasil")
+    search_cache.put(qkey, results)
+    return results
+
+def search_instance(base, query):
+    # Kita cari secara general (tanpa filter music) biar hasilnya PASTI keluar
+    res = upstream.get(f"{base}/search", params={'q': query})
+    if not instance_ok(res): return []
+    return search_items(res.json())
+
+def search_items(data):
+    # Piped kadang ngasih 'content', kadang 'items'
+    items = data.get('content') or data.get('items') or []
+
+    results = []
+    for item in items:
+        v_id = item.get('videoId')
+        if v_id:
+            # Ambil thumbnail yang tersedia
+            thumb = item.get('thumbnail')
+            if isinstance(thumb, list) and len(thumb) > 0:
+                thumb = thumb[-1].get('url')
+
+            results.append({
+                "title": item.get('title', 'Unknown'),
+                "uploaderName": item.get('uploaderName', 'Unknown'),
+                "thumbnail": thumb,
+                "videoId": v_id,
+                "duration": item.get('duration', 0)
+            })
+    return results
+
+APP_CSS = r'''
+/* Hasil compile manual class Tailwind (v3) yang beneran dipakai HTML_TEMPLATE.
+   Nambah class baru di template = nambah aturannya di sini juga. */
+*,::before,::after{box-sizing:border-box;border-width:0;border-style:solid;border-color:#e5e7eb;--tw-translate-x:0;--tw-translate-y:0;--tw-rotate:0;--tw-scale-x:1;--tw-scale-y:1}
+html{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;font-family:ui-sans-serif,system-ui,sans-serif}
+body{margin:0;line-height:inherit}
+h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}
+h1,h2,h3,h4,h5,h6,p,figure,blockquote,dl,dd,pre,hr{margin:0}
+a{color:inherit;text-decoration:inherit}
+button,input,select,textarea{font-family:inherit;font-size:100%;font-weight:inherit;line-height:inherit;color:inherit;margin:0;padding:0}
+button{text-transform:none;background-color:transparent;background-image:none;cursor:pointer}
+input::placeholder{opacity:1;color:#9ca3af}
+img,svg,video,canvas,audio,iframe,embed,object{display:block;vertical-align:middle}
+img,video{max-width:100%;height:auto}
+[hidden]{display:none}
+
+body { background-color: #000; color: white; font-family: 'Figtree', sans-serif; margin: 0; overflow: hidden; cursor: default; }
+.main-content { height: 100vh; overflow-y: auto; padding: 20px 16px 180px 16px; background: linear-gradient(to bottom, #1a1a1a 0%, #000 35%); }
+.player-bar { position: fixed; bottom: 80px; left: 8px; right: 8px; background: #282828; border-radius: 8px; padding: 8px 12px; display: flex; align-items: center; z-index: 100; cursor: pointer; }
+.bottom-nav { position: fixed; bottom: 0; left: 0; right: 0; height: 70px; background: rgba(0,0,0,0.95); display: flex; justify-content: space-around; align-items: center; border-top: 1px solid #111; z-index: 101; }
+.nav-item { display: flex; flex-direction: column; align-items: center; color: #b3b3b3; font-size: 10px; gap: 4px; cursor: pointer; }
+.nav-item.active { color: white; }
+.no-scrollbar::-webkit-scrollbar { display: none; }
+
+.menu-card, .cat-card, button, i, .clickable { cursor: pointer; }
+.menu-card { background: rgba(255,255,255,0.1); transition: all 0.2s; }
+.menu-card:hover { background: rgba(255,255,255,0.15); transform: translateY(-1px); }
+.menu-card:active { background: rgba(255,255,255,0.2); transform: scale(0.98); }
+
+.cat-card { transition: transform 0.2s; }
+.cat-card:hover { transform: scale(1.05); }
+
+.pointer-events-none{pointer-events:none}
+.fixed{position:fixed}.absolute{position:absolute}.relative{position:relative}
+.inset-0{top:0;right:0;bottom:0;left:0}
+.-bottom-2{bottom:-.5rem}.-right-2{right:-.5rem}.left-0{left:0}.right-0{right:0}.right-5{right:1.25rem}.top-1\/2{top:50%}.top-4{top:1rem}
+.z-10{z-index:10}.z-\[200\]{z-index:200}
+.mb-1{margin-bottom:.25rem}.mb-2{margin-bottom:.5rem}.mb-4{margin-bottom:1rem}.mb-6{margin-bottom:1.5rem}.mb-8{margin-bottom:2rem}
+.ml-1{margin-left:.25rem}.ml-3{margin-left:.75rem}.mt-2{margin-top:.5rem}.mt-4{margin-top:1rem}
+.flex{display:flex}.grid{display:grid}.hidden{display:none}
+.aspect-square{aspect-ratio:1/1}.aspect-\[16\/9\]{aspect-ratio:16/9}
+.h-10{height:2.5rem}.h-12{height:3rem}.h-14{height:3.5rem}.h-16{height:4rem}.h-3{height:.75rem}.h-32{height:8rem}.h-\[4px\]{height:4px}.h-full{height:100%}
+.w-0{width:0}.w-10{width:2.5rem}.w-12{width:3rem}.w-14{width:3.5rem}.w-16{width:4rem}.w-3{width:.75rem}.w-32{width:8rem}.w-full{width:100%}
+.max-w-\[320px\]{max-width:320px}
+.flex-1{flex:1 1 0%}.flex-shrink-0{flex-shrink:0}
+.translate-y-full{--tw-translate-y:100%}.-translate-y-1\/2{--tw-translate-y:-50%}.rotate-\[25deg\]{--tw-rotate:25deg}
+.translate-y-full,.-translate-y-1\/2,.rotate-\[25deg\]{transform:translate(var(--tw-translate-x),var(--tw-translate-y)) rotate(var(--tw-rotate)) scale(var(--tw-scale-x),var(--tw-scale-y))}
+@keyframes spin{to{transform:rotate(360deg)}}
+.animate-spin{animation:spin 1s linear infinite}
+.cursor-pointer{cursor:pointer}
+.grid-cols-2{grid-template-columns:repeat(2,minmax(0,1fr))}
+.flex-col{flex-direction:column}
+.items-center{align-items:center}
+.justify-end{justify-content:flex-end}.justify-center{justify-content:center}.justify-between{justify-content:space-between}
+.gap-2{gap:.5rem}.gap-3{gap:.75rem}.gap-4{gap:1rem}
+.space-y-2>:not([hidden])~:not([hidden]){margin-top:.5rem}.space-y-4>:not([hidden])~:not([hidden]){margin-top:1rem}
+.overflow-hidden{overflow:hidden}.overflow-x-auto{overflow-x:auto}
+.truncate{overflow:hidden;text-overflow:ellipsis;white-space:nowrap}
+.rounded{border-radius:.25rem}.rounded-full{border-radius:9999px}.rounded-lg{border-radius:.5rem}.rounded-md{border-radius:.375rem}.rounded-xl{border-radius:.75rem}
+.border{border-width:1px}.border-transparent{border-color:transparent}
+.bg-black\/40{background-color:rgb(0 0 0/.4)}.bg-blue-700{background-color:#1d4ed8}.bg-green-500{background-color:#22c55e}.bg-green-600{background-color:#16a34a}
+.bg-orange-600{background-color:#ea580c}.bg-pink-600{background-color:#db2777}.bg-white{background-color:#fff}
+.bg-zinc-800{background-color:#27272a}.bg-zinc-900{background-color:#18181b}.bg-zinc-950{background-color:#09090b}
+.bg-gradient-to-br{background-image:linear-gradient(to bottom right,var(--tw-gradient-stops))}.bg-gradient-to-t{background-image:linear-gradient(to top,var(--tw-gradient-stops))}
+.from-black\/90{--tw-gradient-from:rgb(0 0 0/.9);--tw-gradient-to:rgb(0 0 0/0);--tw-gradient-stops:var(--tw-gradient-from),var(--tw-gradient-to)}
+.from-indigo-700{--tw-gradient-from:#4338ca;--tw-gradient-to:rgb(67 56 202/0);--tw-gradient-stops:var(--tw-gradient-from),var(--tw-gradient-to)}
+.via-black\/20{--tw-gradient-to:rgb(0 0 0/0);--tw-gradient-stops:var(--tw-gradient-from),rgb(0 0 0/.2),var(--tw-gradient-to)}
+.to-purple-400{--tw-gradient-to:#c084fc}.to-transparent{--tw-gradient-to:transparent}
+.object-cover{object-fit:cover}
+.p-2{padding:.5rem}.p-2\.5{padding:.625rem}.p-3{padding:.75rem}.p-4{padding:1rem}.p-5{padding:1.25rem}.p-8{padding:2rem}
+.px-2{padding-left:.5rem;padding-right:.5rem}.px-4{padding-left:1rem;padding-right:1rem}.px-5{padding-left:1.25rem;padding-right:1.25rem}
+.py-1\.5{padding-top:.375rem;padding-bottom:.375rem}.py-10{padding-top:2.5rem;padding-bottom:2.5rem}.py-3{padding-top:.75rem;padding-bottom:.75rem}
+.pb-10{padding-bottom:2.5rem}.pr-4{padding-right:1rem}
+.text-center{text-align:center}
+.text-2xl{font-size:1.5rem;line-height:2rem}.text-3xl{font-size:1.875rem;line-height:2.25rem}.text-6xl{font-size:3.75rem;line-height:1}.text-7xl{font-size:4.5rem;line-height:1}
+.text-\[10px\]{font-size:10px}.text-\[11px\]{font-size:11px}
+.text-lg{font-size:1.125rem;line-height:1.75rem}.text-sm{font-size:.875rem;line-height:1.25rem}.text-xl{font-size:1.25rem;line-height:1.75rem}.text-xs{font-size:.75rem;line-height:1rem}
+.font-black{font-weight:900}.font-bold{font-weight:700}.font-medium{font-weight:500}.font-semibold{font-weight:600}
+.uppercase{text-transform:uppercase}.italic{font-style:italic}
+.leading-none{line-height:1}.tracking-tight{letter-spacing:-.025em}.tracking-widest{letter-spacing:.1em}
+.text-black{color:#000}.text-green-400{color:#4ade80}.text-green-500{color:#22c55e}.text-red-500{color:#ef4444}.text-white{color:#fff}
+.text-zinc-300{color:#d4d4d8}.text-zinc-400{color:#a1a1aa}.text-zinc-500{color:#71717a}.text-zinc-600{color:#52525b}
+.opacity-0{opacity:0}.opacity-70{opacity:.7}.opacity-80{opacity:.8}
+.shadow-2xl{box-shadow:0 25px 50px -12px var(--tw-shadow-color,rgb(0 0 0/.25))}
+.shadow-lg{box-shadow:0 10px 15px -3px var(--tw-shadow-color,rgb(0 0 0/.1)),0 4px 6px -4px var(--tw-shadow-color,rgb(0 0 0/.1))}
+.shadow-md{box-shadow:0 4px 6px -1px var(--tw-shadow-color,rgb(0 0 0/.1)),0 2px 4px -2px var(--tw-shadow-color,rgb(0 0 0/.1))}
+.shadow-black\/50{--tw-shadow-color:rgb(0 0 0/.5)}
+.outline-none{outline:2px solid transparent;outline-offset:2px}
+.transition{transition-property:color,background-color,border-color,text-decoration-color,fill,stroke,opacity,box-shadow,transform,filter,backdrop-filter;transition-timing-function:cubic-bezier(.4,0,.2,1);transition-duration:150ms}
+.transition-transform{transition-property:transform;transition-timing-function:cubic-bezier(.4,0,.2,1);transition-duration:150ms}
+.duration-300{transition-duration:300ms}
+.hover\:bg-zinc-800:hover{background-color:#27272a}.hover\:bg-zinc-800\/50:hover{background-color:rgb(39 39 42/.5)}
+.hover\:text-green-500:hover{color:#22c55e}.hover\:text-red-500:hover{color:#ef4444}
+.focus\:border-zinc-500:focus{border-color:#71717a}
+.active\:scale-95:active{--tw-scale-x:.95;--tw-scale-y:.95;transform:translate(var(--tw-translate-x),var(--tw-translate-y)) rotate(var(--tw-rotate)) scale(var(--tw-scale-x),var(--tw-scale-y))}
+.active\:bg-zinc-800:active{background-color:#27272a}
+.group:hover .group-hover\:opacity-100{opacity:1}
+'''
+
+SERVICE_WORKER_JS = r'''
+// Service worker Flinn: shell + aset di-cache, thumbnail & audio lagu library disimpan buat offline.
+// __SHELL_VERSION__ ikut berubah tiap HTML/CSS berubah -> SW baru ke-install & cache lama dibuang.
+const VERSION = '__SHELL_VERSION__';
+const SHELL_CACHE = `flinn-shell-${VERSION}`;
+const STATIC_CACHE = 'flinn-static';
+const THUMB_CACHE = 'flinn-thumbs';
+const AUDIO_CACHE = 'flinn-audio';
+const THUMB_MAX = __OFFLINE_THUMBS_MAX__;
+const AUDIO_MAX = __OFFLINE_AUDIO_MAX__;
+const SHELL = ['/', '__APP_CSS_URL__'];
+const STATIC_HOSTS = ['fonts.googleapis.com', 'fonts.gstatic.com', 'cdnjs.cloudflare.com', 'images.unsplash.com'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(SHELL_CACHE)
+        .then(cache => cache.addAll(SHELL.map(url => new Request(url, { cache: 'reload' }))))
+        .then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.filter(k => k.startsWith('flinn-shell-') && k !== SHELL_CACHE).map(k => caches.delete(k))))
+        .then(() => self.clients.claim()));
+});
+
+self.addEventListener('fetch', event => {
+    const req = event.request;
+    if (req.method !== 'GET') return;
+    const url = new URL(req.url);
+
+    if (url.origin !== location.origin) {
+        if (STATIC_HOSTS.includes(url.hostname)) event.respondWith(cacheFirst(STATIC_CACHE, req));
+        return;
+    }
+    // Shell cuma buat halaman utama; navigasi lain (/metrics, /api/..., /sw.js) tetap ke network
+    if (url.pathname === '/') return event.respondWith(staleWhileRevalidate(event, '/'));
+    if (url.pathname.startsWith('/assets/')) return event.respondWith(cacheFirst(SHELL_CACHE, req));
+    if (url.pathname.startsWith('/api/thumb/')) return event.respondWith(cacheFirst(THUMB_CACHE, req, THUMB_MAX));
+
+    const audio = url.pathname.match(/^\/api\/stream\/([^/]+)\/audio$/);
+    if (audio) return event.respondWith(offlineAudio(req, url.pathname));
+    const stream = url.pathname.match(/^\/api\/stream\/([^/]+)$/);
+    if (stream) return event.respondWith(streamLink(req, `${url.pathname}/audio`));
+});
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'cache-audio') event.waitUntil(keepAudio(event.data.yt_id));
+});
+
+async function staleWhileRevalidate(event, key) {
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match(key);
+    const fresh = fetch(key, { cache: 'no-cache' })
+        .then(res => { if (res.ok) return cache.put(key, res.clone()).then(() => res); return res; });
+    if (!cached) return fresh;
+    event.waitUntil(fresh.catch(() => {}));
+    return cached;
+}
+
+async function cacheFirst(name, req, max) {
+    const cache = await caches.open(name);
+    const cached = await cache.match(req);
+    if (cached) return cached;
+    const res = await fetch(req);
+    if (res.ok || res.type === 'opaque') {
+        await cache.put(req, res.clone());
+        if (max) trim(cache, max);
+    }
+    return res;
+}
 
-    return jsonify({"content": []})
+async function trim(cache, max) {
+    // Key di Cache Storage urut sesuai waktu masuk, yang paling lama dibuang duluan
+    const keys = await cache.keys();
+    for (const key of keys.slice(0, Math.max(0, keys.length - max))) await cache.delete(key);
+}
+
+// Lagu yang audionya udah disimpan gak perlu resolve link ke server sama sekali
+async function streamLink(req, audioPath) {
+    const cached = await caches.open(AUDIO_CACHE).then(cache => cache.match(audioPath));
+    if (cached) {
+        return new Response(JSON.stringify({ url: audioPath, proxy: audioPath }),
+                            { headers: { 'Content-Type': 'application/json' } });
+    }
+    return fetch(req);
+}
+
+async function offlineAudio(req, audioPath) {
+    const cached = await caches.open(AUDIO_CACHE).then(cache => cache.match(audioPath));
+    if (!cached) return fetch(req);
+
+    // <audio> hampir selalu minta Range, jawab 206 dari potongan blob yang disimpan
+    const blob = await cached.blob();
+    const range = req.headers.get('Range');
+    const m = range && range.match(/^bytes=(\d*)-(\d*)$/);
+    if (!m || (!m[1] && !m[2])) {
+        return new Response(blob, { headers: { 'Content-Type': blob.type || 'audio/mp4', 'Accept-Ranges': 'bytes',
+                                               'Content-Length': String(blob.size) } });
+    }
+    let start = m[1] ? Number(m[1]) : Math.max(0, blob.size - Number(m[2]));
+    let end = m[1] && m[2] ? Math.min(Number(m[2]), blob.size - 1) : blob.size - 1;
+    if (start >= blob.size || start > end) {
+        return new Response(null, { status: 416, headers: { 'Content-Range': `bytes */${blob.size}` } });
+    }
+    return new Response(blob.slice(start, end + 1), { status: 206, headers: {
+        'Content-Type': blob.type || 'audio/mp4', 'Accept-Ranges': 'bytes',
+        'Content-Range': `bytes ${start}-${end}/${blob.size}`, 'Content-Length': String(end - start + 1),
+    } });
+}
+
+async function keepAudio(ytId) {
+    if (!ytId) return;
+    const audioPath = `/api/stream/${encodeURIComponent(ytId)}/audio`;
+    const cache = await caches.open(AUDIO_CACHE);
+    if (await cache.match(audioPath)) return;
+    try {
+        const res = await fetch(audioPath);
+        if (res.status !== 200) return;
+        await cache.put(audioPath, res);
+        await trim(cache, AUDIO_MAX);
+    } catch (e) {
+        console.error(e);
+    }
+}
+'''
 
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -147,26 +2325,11 @@ HTML_TEMPLATE = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">
     <title>Music Hub - Flinn</title>
-    <script src="https://cdn.tailwindcss.com"></script>
+    <link rel="preconnect" href="https://fonts.googleapis.com">
+    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+    <link rel="stylesheet" href="https://fonts.googleapis.com/css2?family=Figtree:wght@300;400;600;700;800&display=swap">
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.0/css/all.min.css">
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Figtree:wght@300;400;600;700;800&display=swap');
-    body { background-color: #000; color: white; font-family: 'Figtree', sans-serif; margin: 0; overflow: hidden; cursor: default; }
-    .main-content { height: 100vh; overflow-y: auto; padding: 20px 16px 180px 16px; background: linear-gradient(to bottom, #1a1a1a 0%, #000 35%); }
-    .player-bar { position: fixed; bottom: 80px; left: 8px; right: 8px; background: #282828; border-radius: 8px; padding: 8px 12px; display: flex; align-items: center; z-index: 100; cursor: pointer; }
-    .bottom-nav { position: fixed; bottom: 0; left: 0; right: 0; height: 70px; background: rgba(0,0,0,0.95); display: flex; justify-content: space-around; align-items: center; border-top: 1px solid #111; z-index: 101; }
-    .nav-item { display: flex; flex-direction: column; align-items: center; color: #b3b3b3; font-size: 10px; gap: 4px; cursor: pointer; }
-    .nav-item.active { color: white; }
-    .no-scrollbar::-webkit-scrollbar { display: none; }
-    
-    .menu-card, .cat-card, button, i, .clickable { cursor: pointer; }
-    .menu-card { background: rgba(255,255,255,0.1); transition: all 0.2s; }
-    .menu-card:hover { background: rgba(255,255,255,0.15); transform: translateY(-1px); }
-    .menu-card:active { background: rgba(255,255,255,0.2); transform: scale(0.98); }
-    
-    .cat-card { transition: transform 0.2s; }
-    .cat-card:hover { transform: scale(1.05); }
-</style>
+    <link rel="stylesheet" href="__APP_CSS_URL__">
 </head>
 <body>
 
@@ -269,6 +2432,7 @@ HTML_TEMPLATE = '''
                 <button onclick="doSearch()" class="absolute right-5 top-4 text-zinc-400">
                     <i class="fa-solid fa-magnifying-glass"></i>
                 </button>
+                <div id="suggestBox" class="hidden absolute left-0 right-0 mt-2 bg-zinc-900 rounded-xl overflow-hidden shadow-2xl z-10"></div>
             </div>
             <div id="searchResult" class="space-y-2"></div>
         </div>
@@ -357,8 +2521,17 @@ HTML_TEMPLATE = '''
     let isShuffle = false;
     let currentPlaylist = [];
     let currentIndex = -1;
+    let shuffleQueue = [];
+
+    const PREFETCH_AHEAD = 3;
 
     const DEFAULT_COVER = "https://images.unsplash.com/photo-1470225620780-dba8ba36b745?w=500";
+    const DEFAULT_THUMB = "https://images.unsplash.com/photo-1470225620780-dba8ba36b745?w=96";
+
+    // Cover kecil buat list: lewat /api/thumb (udah di-resize & di-cache), cover asli cuma dipakai player besar
+    function thumbUrl(yt_id, cover, w) {
+        return yt_id ? `/api/thumb/${encodeURIComponent(yt_id)}?w=${w}` : (cover || DEFAULT_THUMB);
+    }
 
     function quickSearch(keyword) {
         const searchNavItem = document.querySelectorAll('.nav-item')[1];
@@ -383,10 +2556,100 @@ HTML_TEMPLATE = '''
         else if(tab === 'library') { document.getElementById('libraryView').classList.remove('hidden'); renderLibrary(); }
     }
 
+    // Salinan library di memori + mirror di IndexedDB. Buka app langsung render dari mirror,
+    // habis itu cukup minta delta sejak versi terakhir. Offline -> mirror-nya aja yang dipakai.
+    let library = null;
+    const LIBRARY_PAGE = 200;
+
+    function idbOpen() {
+        if (!window.indexedDB) return Promise.resolve(null);
+        return new Promise(resolve => {
+            const req = indexedDB.open('flinn', 1);
+            req.onupgradeneeded = () => {
+                req.result.createObjectStore('songs', { keyPath: 'yt_id' });
+                req.result.createObjectStore('meta');
+            };
+            req.onsuccess = () => resolve(req.result);
+            req.onerror = () => resolve(null);
+        });
+    }
+    const idb = idbOpen();
+
+    async function idbLoadLibrary() {
+        const db = await idb;
+        if (!db) return null;
+        return new Promise(resolve => {
+            const tx = db.transaction(['songs', 'meta'], 'readonly');
+            const songs = tx.objectStore('songs').getAll();
+            const version = tx.objectStore('meta').get('version');
+            tx.oncomplete = () => resolve(version.result === undefined ? null
+                : { version: version.result, songs: songs.result.sort((a, b) => b.id - a.id) });
+            tx.onerror = () => resolve(null);
+        });
+    }
+
+    // Satu transaksi per sync: tambah/hapus lagu + versi barunya, jadi mirror gak pernah setengah jadi
+    async function idbSaveLibrary(version, added, deleted, replace) {
+        const db = await idb;
+        if (!db) return;
+        return new Promise(resolve => {
+            const tx = db.transaction(['songs', 'meta'], 'readwrite');
+            const store = tx.objectStore('songs');
+            if (replace) store.clear();
+            deleted.forEach(id => store.delete(id));
+            added.forEach(s => store.put(s));
+            tx.objectStore('meta').put(version, 'version');
+            tx.oncomplete = tx.onerror = () => resolve();
+        });
+    }
+
+    async function loadLibrary() {
+        if (!library) library = await idbLoadLibrary();
+        try {
+            if (library) {
+                const res = await fetch(`/api/content?since=${library.version}`);
+                const d = await res.json();
+                if (!d.reset) {
+                    if (d.version !== library.version) {
+                        const changed = new Set(d.deleted.concat(d.added.map(s => s.yt_id)));
+                        library.songs = d.added.concat(library.songs.filter(s => !changed.has(s.yt_id)));
+                        library.songs.sort((a, b) => b.id - a.id);
+                        library.version = d.version;
+                        await idbSaveLibrary(d.version, d.added, d.deleted, false);
+                    }
+                    return library.songs;
+                }
+            }
+            let songs = [], cursor = null, version = null;
+            do {
+                const res = await fetch(`/api/content?limit=${LIBRARY_PAGE}` + (cursor ? `&cursor=${cursor}` : ''));
+                const d = await res.json();
+                if (version === null) version = d.version;
+                songs = songs.concat(d.songs);
+                cursor = d.next_cursor;
+            } while (cursor);
+            library = { version, songs };
+            await idbSaveLibrary(version, songs, [], true);
+        } catch (e) {
+            // Server gak kejangkau: pakai mirror apa adanya
+            if (!library) return [];
+        }
+        return library.songs;
+    }
+
     async function renderLibrary() {
-        const res = await fetch('/api/content');
-        const data = await res.json();
+        // Mirror dirender duluan biar instan, versi hasil sync nyusul kalau ada yang berubah
+        if (!library) {
+            library = await idbLoadLibrary();
+            if (library) drawLibrary(library.songs);
+        }
+        drawLibrary(await loadLibrary());
+    }
+
+    function drawLibrary(songs) {
+        const data = { songs: songs.slice() };
         currentPlaylist = data.songs;
+        shuffleQueue = [];
         const libList = document.getElementById('libraryList');
         if(data.songs.length === 0) {
             libList.innerHTML = '<p class="text-zinc-500 text-center py-10 text-sm italic">Library masih kosong nih.</p>';
@@ -394,7 +2657,7 @@ HTML_TEMPLATE = '''
         }
         libList.innerHTML = data.songs.map((s, index) => `
             <div class="flex items-center gap-3 p-2 active:bg-zinc-800 rounded-md cursor-pointer transition">
-                <img src="${s.cover}" onerror="this.src='${DEFAULT_COVER}'" class="w-12 h-12 rounded object-cover" onclick="playSongByIndex(${index})">
+                <img src="${thumbUrl(s.yt_id, s.cover, 96)}" loading="lazy" onerror="this.onerror=null;this.src='${DEFAULT_THUMB}'" class="w-12 h-12 rounded object-cover" onclick="playSongByIndex(${index})">
                 <div class="flex-1 overflow-hidden" onclick="playSongByIndex(${index})">
                     <div class="text-sm font-bold truncate">${s.title}</div>
                     <div class="text-[11px] text-zinc-400 truncate">${s.artist}</div>
@@ -409,16 +2672,37 @@ HTML_TEMPLATE = '''
         currentIndex = index;
         const s = currentPlaylist[index];
         playSong(s.yt_id, s.title, s.artist, s.cover);
+        prefetchUpcoming();
+    }
+
+    // Index lagu yang bakal diputer berikutnya, ngikutin mode shuffle/repeat
+    function upcomingIndexes(n) {
+        if (currentPlaylist.length === 0 || currentIndex === -1 || isRepeat) return [];
+        if (isShuffle) {
+            while (shuffleQueue.length < n) shuffleQueue.push(Math.floor(Math.random() * currentPlaylist.length));
+            return shuffleQueue.slice(0, n);
+        }
+        const out = [];
+        for (let i = 1; i <= Math.min(n, currentPlaylist.length - 1); i++) out.push((currentIndex + i) % currentPlaylist.length);
+        return out;
+    }
+
+    function prefetchUpcoming() {
+        const ids = upcomingIndexes(PREFETCH_AHEAD).map(i => currentPlaylist[i].yt_id);
+        if (ids.length === 0) return;
+        fetch('/api/prefetch', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify({ ids }) })
+            .catch(() => {});
     }
 
     async function playSong(id, title, artist, cover) {
+        playingId = id;
         // 1. Update UI
         document.getElementById('pTitle').innerText = title;
         document.getElementById('mTitle').innerText = title;
         document.getElementById('pArtist').innerText = artist;
         document.getElementById('mArtist').innerText = artist;
-        document.getElementById('pCover').src = cover;
-        document.getElementById('mCover').src = cover;
+        document.getElementById('pCover').src = thumbUrl(id, cover, 96);
+        document.getElementById('mCover').src = cover || DEFAULT_COVER;
     
         const btn = document.getElementById('playBtn');
         btn.className = "fa-solid fa-spinner animate-spin text-2xl text-green-500";
@@ -429,7 +2713,8 @@ HTML_TEMPLATE = '''
             const data = await res.json();
     
             if (data.url) {
-                audio.src = data.url;
+                // Lewat proxy kita sendiri biar seek = Range request murah & link expired di-resolve ulang
+                audio.src = data.proxy || data.url;
                 audio.play().then(() => {
                     isPlaying = true;
                     updateUI();
@@ -465,7 +2750,7 @@ HTML_TEMPLATE = '''
     function nextSong() { 
         if(currentPlaylist.length === 0) return;
         if(isShuffle) {
-            playSongByIndex(Math.floor(Math.random() * currentPlaylist.length));
+            playSongByIndex(shuffleQueue.length ? shuffleQueue.shift() : Math.floor(Math.random() * currentPlaylist.length));
         } else {
             currentIndex < currentPlaylist.length - 1 ? playSongByIndex(currentIndex + 1) : playSongByIndex(0);
         }
@@ -476,8 +2761,8 @@ HTML_TEMPLATE = '''
         currentIndex > 0 ? playSongByIndex(currentIndex - 1) : playSongByIndex(currentPlaylist.length - 1); 
     }
 
-    function toggleRepeat(el) { isRepeat = !isRepeat; el.style.color = isRepeat ? '#22c55e' : '#52525b'; }
-    function toggleShuffle(el) { isShuffle = !isShuffle; el.style.color = isShuffle ? '#22c55e' : '#52525b'; }
+    function toggleRepeat(el) { isRepeat = !isRepeat; el.style.color = isRepeat ? '#22c55e' : '#52525b'; prefetchUpcoming(); }
+    function toggleShuffle(el) { isShuffle = !isShuffle; shuffleQueue = []; el.style.color = isShuffle ? '#22c55e' : '#52525b'; prefetchUpcoming(); }
     function toggleLike(el) { el.classList.toggle('fa-regular'); el.classList.toggle('fa-solid'); el.classList.toggle('text-green-500'); }
 
     function showMore() {
@@ -509,59 +2794,144 @@ HTML_TEMPLATE = '''
         audio.currentTime = pos * audio.duration;
     }
 
-    audio.onended = () => isRepeat ? audio.play() : nextSong();
+    // Lagu library yang udah keputer sampai habis disimpan service worker buat diputer offline
+    // (byte-nya saat itu udah ada di audio cache server, jadi gak nembak upstream lagi)
+    let playingId = null;
+    function keepOffline(id) {
+        const sw = navigator.serviceWorker && navigator.serviceWorker.controller;
+        if (sw && library && library.songs.some(s => s.yt_id === id)) sw.postMessage({ type: 'cache-audio', yt_id: id });
+    }
+
+    audio.onended = () => {
+        keepOffline(playingId);
+        isRepeat ? audio.play() : nextSong();
+    };
+
+    function searchItemHTML(s) {
+        const songData = {
+            title: s.title.replace(/'/g, ""),
+            artist: s.uploaderName.replace(/'/g, ""),
+            cover: s.thumbnail,
+            yt_id: s.videoId || (s.url ? s.url.split("v=")[1] : ""),
+            duration: s.duration >= 0 ? formatTime(s.duration) : "3:00"
+        };
+
+        return `
+            <div class="flex items-center gap-4 p-2.5 hover:bg-zinc-800/50 rounded-md transition group cursor-pointer">
+                <div class="relative w-12 h-12 flex-shrink-0" onclick="playSong('${songData.yt_id}', '${songData.title}', '${songData.artist}', '${songData.cover}')">
+                    <img src="${thumbUrl(songData.yt_id, songData.cover, 96)}" loading="lazy" onerror="this.onerror=null;this.src='${DEFAULT_THUMB}'" class="w-full h-full rounded object-cover shadow-lg">
+                    <div class="absolute inset-0 flex items-center justify-center bg-black/40 opacity-0 group-hover:opacity-100 transition">
+                        <i class="fa-solid fa-play text-white text-xs"></i>
+                    </div>
+                </div>
+                <div class="flex-1 overflow-hidden" onclick="playSong('${songData.yt_id}', '${songData.title}', '${songData.artist}', '${songData.cover}')">
+                    <div class="text-sm font-semibold text-white truncate">${songData.title}</div>
+                    <div class="text-[11px] text-zinc-400 truncate">${s.inLibrary ? '<span class="text-green-500 font-semibold">Library</span> • ' : ''}${songData.artist}</div>
+                </div>
+                <div class="flex items-center gap-4">
+                    <span class="text-[10px] text-zinc-500 font-medium">${songData.duration}</span>
+                    <i class="fa-solid fa-circle-plus text-xl text-zinc-600 hover:text-green-500 transition" 
+                       onclick='addSong(${JSON.stringify(songData).replace(/'/g, "&apos;")})'></i>
+                </div>
+            </div>
+        `;
+    }
+
+    // Hasil search dikirim server per batch (NDJSON), langsung dirender begitu datang.
+    // Search baru ngebatalin stream yang lama.
+    let searchAbort = null;
 
     async function doSearch() {
         const q = document.getElementById('searchInput').value;
         if (!q) return;
         
+        hideSuggestions();
         const resultDiv = document.getElementById('searchResult');
         resultDiv.innerHTML = '<div class="flex justify-center py-10"><i class="fa-solid fa-spinner animate-spin text-3xl text-green-500"></i></div>';
-        
+
+        if (searchAbort) searchAbort.abort();
+        const ctrl = searchAbort = new AbortController();
+        const seen = new Set();
+        let list = null;
+
+        const render = (items) => {
+            items = items.filter(s => !seen.has(s.videoId));
+            if (items.length === 0) return;
+            items.forEach(s => seen.add(s.videoId));
+            if (!list) {
+                resultDiv.innerHTML = '<p class="text-[10px] font-bold text-zinc-400 uppercase tracking-widest mb-4 ml-1">Hasil Pencarian</p><div class="space-y-2"></div>';
+                list = resultDiv.lastElementChild;
+            }
+            list.insertAdjacentHTML('beforeend', items.map(searchItemHTML).join(''));
+        };
+
         try {
-            const res = await fetch(`/api/search?q=${encodeURIComponent(q)}`);
-            const data = await res.json();
-            
-            if (data.content && data.content.length > 0) {
-                resultDiv.innerHTML = `
-                    <p class="text-[10px] font-bold text-zinc-400 uppercase tracking-widest mb-4 ml-1">Hasil Pencarian</p>
-                    ${data.content.map(s => {
-                        const songData = {
-                            title: s.title.replace(/'/g, ""),
-                            artist: s.uploaderName.replace(/'/g, ""),
-                            cover: s.thumbnail,
-                            yt_id: s.videoId || (s.url ? s.url.split("v=")[1] : ""),
-                            duration: s.duration >= 0 ? formatTime(s.duration) : "3:00"
-                        };
-    
-                        return `
-                            <div class="flex items-center gap-4 p-2.5 hover:bg-zinc-800/50 rounded-md transition group cursor-pointer">
-                                <div class="relative w-12 h-12 flex-shrink-0" onclick="playSong('${songData.yt_id}', '${songData.title}', '${songData.artist}', '${songData.cover}')">
-                                    <img src="${songData.cover}" onerror="this.src='${DEFAULT_COVER}'" class="w-full h-full rounded object-cover shadow-lg">
-                                    <div class="absolute inset-0 flex items-center justify-center bg-black/40 opacity-0 group-hover:opacity-100 transition">
-                                        <i class="fa-solid fa-play text-white text-xs"></i>
-                                    </div>
-                                </div>
-                                <div class="flex-1 overflow-hidden" onclick="playSong('${songData.yt_id}', '${songData.title}', '${songData.artist}', '${songData.cover}')">
-                                    <div class="text-sm font-semibold text-white truncate">${songData.title}</div>
-                                    <div class="text-[11px] text-zinc-400 truncate">${songData.artist}</div>
-                                </div>
-                                <div class="flex items-center gap-4">
-                                    <span class="text-[10px] text-zinc-500 font-medium">${songData.duration}</span>
-                                    <i class="fa-solid fa-circle-plus text-xl text-zinc-600 hover:text-green-500 transition" 
-                                       onclick='addSong(${JSON.stringify(songData).replace(/'/g, "&apos;")})'></i>
-                                </div>
-                            </div>
-                        `;
-                    }).join('')}`;
-            } else {
+            const res = await fetch(`/api/search?stream=1&q=${encodeURIComponent(q)}`, { signal: ctrl.signal });
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buf = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buf += decoder.decode(value, { stream: true });
+                const lines = buf.split('\\n');
+                buf = lines.pop();
+                lines.filter(Boolean).forEach(line => render(JSON.parse(line).content || []));
+            }
+            if (buf.trim()) render(JSON.parse(buf).content || []);
+
+            if (!list) {
                 resultDiv.innerHTML = '<p class="text-center py-10 text-zinc-500">Gak ada hasil, coba cari yang lain Flinn.</p>';
             }
         } catch (err) {
-            resultDiv.innerHTML = '<p class="text-center text-red-500 py-10">Pencarian Spotify-style lagi error!</p>';
+            if (err.name === 'AbortError') return;
+            if (!list) resultDiv.innerHTML = '<p class="text-center text-red-500 py-10">Pencarian Spotify-style lagi error!</p>';
         }
     }
 
+    // Saran sambil ngetik: debounce dulu, request lama dibatalin kalau user masih ngetik
+    let suggestTimer = null;
+    let suggestAbort = null;
+
+    function hideSuggestions() {
+        clearTimeout(suggestTimer);
+        if (suggestAbort) suggestAbort.abort();
+        document.getElementById('suggestBox').classList.add('hidden');
+    }
+
+    function onSearchInput(e) {
+        clearTimeout(suggestTimer);
+        const q = e.target.value.trim();
+        if (!q) return hideSuggestions();
+        suggestTimer = setTimeout(async () => {
+            if (suggestAbort) suggestAbort.abort();
+            const ctrl = suggestAbort = new AbortController();
+            try {
+                const res = await fetch(`/api/suggest?q=${encodeURIComponent(q)}`, { signal: ctrl.signal });
+                const data = await res.json();
+                const box = document.getElementById('suggestBox');
+                if (ctrl.signal.aborted || data.suggestions.length === 0) return box.classList.add('hidden');
+                // Saran asalnya dari query user lain, jadi teksnya lewat textContent, bukan innerHTML
+                box.replaceChildren(...data.suggestions.map(t => {
+                    const row = document.createElement('div');
+                    row.className = 'px-5 py-3 text-sm text-zinc-300 hover:bg-zinc-800 cursor-pointer flex items-center gap-3';
+                    row.dataset.q = t;
+                    row.innerHTML = '<i class="fa-solid fa-magnifying-glass text-xs text-zinc-500"></i><span class="truncate"></span>';
+                    row.querySelector('span').textContent = t;
+                    return row;
+                }));
+                box.classList.remove('hidden');
+            } catch (err) {}
+        }, 150);
+    }
+
+    function pickSuggestion(e) {
+        const item = e.target.closest('[data-q]');
+        if (!item) return;
+        document.getElementById('searchInput').value = item.dataset.q;
+        doSearch();
+    }
+
     async function addSong(s) {
         await fetch('/api/add', { method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(s) });
         alert('Ditambahkan ke Library!');
@@ -571,15 +2941,57 @@ HTML_TEMPLATE = '''
         if(confirm('Hapus lagu dari Library?')) { await fetch('/api/delete/' + id, { method: 'DELETE' }); renderLibrary(); }
     }
 
+    if ('serviceWorker' in navigator) {
+        window.addEventListener('load', () => navigator.serviceWorker.register('/sw.js').catch(e => console.error(e)));
+    }
+
     document.addEventListener('DOMContentLoaded', () => {
         document.getElementById('progCont').onclick = seek;
         document.getElementById('searchInput')?.addEventListener('keypress', (e) => e.key === 'Enter' && doSearch());
+        document.getElementById('searchInput')?.addEventListener('input', onSearchInput);
+        document.getElementById('suggestBox').onclick = pickSuggestion;
     });
 </script>
 </body>
 </html>
 '''
 
+APP_CSS_DIGEST = hashlib.sha256(APP_CSS.encode('utf-8')).hexdigest()[:16]
+app_css_asset = CompressedAsset(APP_CSS, 'text/css; charset=utf-8', 'public, max-age=31536000, immutable')
+with app.app_context():
+    app_shell = CompressedAsset(
+        render_template_string(HTML_TEMPLATE).replace('__APP_CSS_URL__', f'/assets/app.{APP_CSS_DIGEST}.css'),
+        'text/html; charset=utf-8', f'public, max-age={SHELL_MAX_AGE}, stale-while-revalidate=86400')
+# SW-nya sendiri selalu divalidasi ulang (no-cache) biar deploy baru langsung kedeteksi browser
+service_worker_asset = CompressedAsset(
+    SERVICE_WORKER_JS.replace('__SHELL_VERSION__', app_shell.etag.strip('"')[:16])
+    .replace('__APP_CSS_URL__', f'/assets/app.{APP_CSS_DIGEST}.css')
+    .replace('__OFFLINE_THUMBS_MAX__', str(OFFLINE_THUMBS_MAX))
+    .replace('__OFFLINE_AUDIO_MAX__', str(OFFLINE_AUDIO_MAX)),
+    'application/javascript; charset=utf-8', 'no-cache')
+
+init_db()
+if YTDLP_FALLBACK:
+    try:
+        YTDLP_FALLBACK = ytdlp_resolver.start()
+    except (OSError, ValueError) as e:
+        print(f"Error ytdlp start: {e}")
+        YTDLP_FALLBACK = False
+if AUDIO_CACHE:
+    try:
+        audio_cache.reconcile()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error audio_cache reconcile: {e}")
+        AUDIO_CACHE = False
+try:
+    thumb_cache.load()
+except OSError as e:
+    print(f"Error thumb_cache load: {e}")
+try:
+    suggest_index.seed()
+except sqlite3.Error as e:
+    print(f"Error suggest seed: {e}")
+
 # Ganti bagian if __name__ == '__main__': ini
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,154 @@
+# Mock Piped API buat benchmark offline. Tiap instance = satu ThreadingHTTPServer di port sendiri
+# dengan profil latency / failure / ukuran payload masing-masing. Endpoint yang ditiru cuma yang
+# dipakai app: /search, /streams/<id>, /healthcheck.
+#
+# Jalan sendiri (misal buat nembak server yang lagi jalan pakai PIPED_*_INSTANCES):
+#   python bench/mock_piped.py --instance latency=0.05 --instance latency=0.2,fail=0.1
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import argparse, json, random, threading, time
+
+DEFAULT_PROFILE = {
+    'latency': 0.05,   # detik, dasar tiap response
+    'jitter': 0.02,    # + uniform(0, jitter)
+    'fail': 0.0,       # peluang balas HTTP 503
+    'stall': 0.0,      # peluang ngegantung stall_s detik (buat tail latency / timeout)
+    'stall_s': 6.0,
+    'items': 20,       # jumlah item hasil search
+    'pad': 200,        # byte tambahan per item (deskripsi), ngatur ukuran payload
+}
+
+def parse_profile(text):
+    # "latency=0.1,fail=0.05,items=30" -> dict profil lengkap
+    profile = dict(DEFAULT_PROFILE)
+    for part in filter(None, (text or '').split(',')):
+        key, _, value = part.partition('=')
+        key = key.strip()
+        if key not in profile: raise ValueError(f"Profil mock gak kenal '{key}'")
+        profile[key] = type(DEFAULT_PROFILE[key])(float(value))
+    return profile
+
+class MockPiped:
+    def __init__(self, profile, seed=0, host='127.0.0.1', port=0):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        handler = type('Handler', (MockHandler,), {'mock': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def roll(self):
+        # -> (delay, gagal?) ; RNG di-lock biar hasil satu seed tetap sama
+        p = self.profile
+        with self.lock:
+            self.requests += 1
+            delay = p['latency'] + self.rng.uniform(0, p['jitter'])
+            if self.rng.random() < p['stall']: delay += p['stall_s']
+            return delay, self.rng.random() < p['fail']
+
+    def search_payload(self, query):
+        p = self.profile
+        seed = sum(map(ord, query))
+        items = [{
+            'url': f"/watch?v={video_id(seed + i)}",
+            'type': 'stream',
+            'title': f"{query} #{i + 1}",
+            'thumbnail': f"{self.url}/vi/{video_id(seed + i)}/mqdefault.jpg",
+            'uploaderName': f"Artist {(seed + i) % 97}",
+            'videoId': video_id(seed + i),
+            'duration': 120 + (seed + i) % 240,
+            'shortDescription': 'x' * p['pad'],
+        } for i in range(p['items'])]
+        return {'items': items, 'nextpage': None, 'suggestion': None, 'corrected': False}
+
+    def stream_payload(self, yt_id):
+        expire = int(time.time()) + 6 * 3600
+        return {
+            'title': f"Video {yt_id}",
+            'uploader': 'Mock',
+            'duration': 200,
+            'audioStreams': [
+                {'url': f"{self.url}/videoplayback?id={yt_id}&expire={expire}&itag=140",
+                 'format': 'M4A', 'mimeType': 'audio/mp4', 'bitrate': 128000},
+            ],
+        }
+
+def video_id(n):
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'
+    out = ''
+    for _ in range(11):
+        n, r = divmod(n * 2654435761 + 1, 64)
+        out += alphabet[r]
+    return out
+
+class MockHandler(BaseHTTPRequestHandler):
+    mock = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/healthcheck': return self.reply(200, {'status': 'ok'})
+
+        delay, fail = self.mock.roll()
+        time.sleep(delay)
+        if fail: return self.reply(503, {'error': 'mock failure'})
+
+        if url.path == '/search':
+            query = parse_qs(url.query).get('q', [''])[0]
+            return self.reply(200, self.mock.search_payload(query))
+        if url.path.startswith('/streams/'):
+            return self.reply(200, self.mock.stream_payload(url.path[len('/streams/'):]))
+        self.reply(404, {'error': 'not found'})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+def start_instances(profiles, seed=0):
+    return [MockPiped(profile, seed=seed + i).start() for i, profile in enumerate(profiles)]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock Piped API lokal')
+    parser.add_argument('--instance', action='append', default=[],
+                        help='profil satu instance, misal "latency=0.1,fail=0.05" (bisa diulang)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=0, help='port instance pertama (sisanya +1, +2, ...)')
+    args = parser.parse_args()
+
+    profiles = [parse_profile(text) for text in args.instance] or [dict(DEFAULT_PROFILE)]
+    mocks = [MockPiped(p, seed=args.seed + i, port=args.port + i if args.port else 0).start()
+             for i, p in enumerate(profiles)]
+    urls = ','.join(m.url for m in mocks)
+    print(f"PIPED_SEARCH_INSTANCES={urls}")
+    print(f"PIPED_STREAM_INSTANCES={urls}")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        for m in mocks: m.stop()
@@ -0,0 +1,238 @@
+# Benchmark offline: nyalain beberapa mock Piped lokal, nyalain app (Flask threaded atau ASGI) di
+# subprocess sendiri dengan instance list diarahkan ke mock, lalu replay campuran traffic search / stream / add /
+# content / suggest. Hasilnya JSON (throughput + p50/p95/p99 per operasi) biar bisa dibandingin antar commit.
+#
+#   python bench/run.py --duration 30 --concurrency 32 --out bench-$(git rev-parse --short HEAD).json
+#   python bench/run.py --server asgi --instance latency=0.05 --instance latency=0.4,fail=0.2
+#   python bench/run.py --target http://127.0.0.1:5000   # server yang udah jalan (env PIPED_* diatur sendiri)
+from concurrent.futures import ThreadPoolExecutor
+import argparse, bisect, json, os, platform, random, shutil, socket, subprocess, sys, tempfile, threading, time
+import requests
+
+from mock_piped import parse_profile, start_instances
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = 'search=40,stream=35,content=15,suggest=5,add=5'
+DEFAULT_INSTANCES = ['latency=0.04,jitter=0.02', 'latency=0.12,jitter=0.08,fail=0.05',
+                     'latency=0.3,jitter=0.2,fail=0.2,stall=0.01']
+WORDS = ('love night dance summer heart fire rain blue dream city road star light girl boy home sky '
+         'baby gold wild sweet time lost young money moon party slow run cold world').split()
+
+def zipf_picker(rng, n, s=1.1):
+    # Ambil index 0..n-1 dengan distribusi Zipf, biar ada query/lagu "populer" yang ke-hit cache
+    weights = [1 / (k + 1) ** s for k in range(n)]
+    total = sum(weights)
+    cumulative, acc = [], 0.0
+    for w in weights:
+        acc += w / total
+        cumulative.append(acc)
+    return lambda: min(bisect.bisect_left(cumulative, rng.random()), n - 1)
+
+class Workload:
+    # Urutan operasi di-generate dari seed, jadi dua run dengan seed sama ngirim request yang sama
+    def __init__(self, mix, seed, queries, songs):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        names, weights = zip(*mix.items())
+        self.names, self.cumulative = names, []
+        acc = 0
+        for w in weights:
+            acc += w
+            self.cumulative.append(acc)
+        self.queries = [' '.join(self.rng.sample(WORDS, self.rng.randint(1, 3))) for _ in range(queries)]
+        self.songs = [f"bench{i:06d}" for i in range(songs)]
+        self.pick_query = zipf_picker(self.rng, queries)
+        self.pick_song = zipf_picker(self.rng, songs)
+        self.added = 0
+
+    def next(self):
+        with self.lock:
+            op = self.names[bisect.bisect_right(self.cumulative, self.rng.random() * self.cumulative[-1])]
+            if op == 'search': return op, ('GET', '/api/search', {'params': {'q': self.queries[self.pick_query()]}})
+            if op == 'stream': return op, ('GET', f"/api/stream/{self.songs[self.pick_song()]}", {})
+            if op == 'suggest':
+                q = self.queries[self.pick_query()]
+                return op, ('GET', '/api/suggest', {'params': {'q': q[:self.rng.randint(1, len(q))]}})
+            if op == 'add':
+                self.added += 1
+                song = {'yt_id': f"add{self.rng.getrandbits(40):010x}", 'title': f"Bench song {self.added}",
+                        'artist': self.rng.choice(WORDS).title(), 'cover': '', 'duration': '3:00'}
+                return op, ('POST', '/api/add', {'json': song})
+            return op, ('GET', '/api/content', {'params': {'limit': 50}})
+
+def percentile(sorted_values, pct):
+    if not sorted_values: return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def summarize(samples, elapsed):
+    # samples: list (latency_detik, ok)
+    latencies = sorted(lat for lat, _ in samples)
+    ms = lambda v: round(v * 1000, 2) if v is not None else None
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, ok in samples if not ok),
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+def run_load(target, workload, concurrency, duration, max_requests, timeout):
+    results = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    sent = [0]
+
+    def worker():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and sent[0] >= max_requests: return
+                sent[0] += 1
+            op, (method, path, kwargs) = workload.next()
+            start = time.perf_counter()
+            try:
+                res = session.request(method, target + path, timeout=timeout, **kwargs)
+                res.content
+                ok = res.status_code < 500
+            except requests.RequestException:
+                ok = False
+            latency = time.perf_counter() - start
+            with lock:
+                results.setdefault(op, []).append((latency, ok))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for f in [pool.submit(worker) for _ in range(concurrency)]: f.result()
+    return results, time.perf_counter() - started
+
+# Server Flask buat subprocess: threaded kayak `flask run`, tapi tanpa access log per request
+FLASK_SERVER = '''
+import logging, sys
+from werkzeug.serving import make_server
+import index
+logging.getLogger('werkzeug').setLevel(logging.WARNING)
+srv = make_server('127.0.0.1', int(sys.argv[1]), index.app, threaded=True)
+srv.socket.listen(2048)
+srv.serve_forever()
+'''
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_app(server, mocks, workdir, timeout=30):
+    # App jalan di proses sendiri: kalau satu proses sama load generator, GIL-nya rebutan dan
+    # angka yang dibandingin antar commit ikut kecampur overhead client. -> (url, proses)
+    urls = ','.join(m.url for m in mocks)
+    env = dict(os.environ, **{
+        'PIPED_SEARCH_INSTANCES': urls, 'PIPED_STREAM_INSTANCES': urls,
+        'DB_PATH': os.path.join(workdir, 'bench.db'),
+        'AUDIO_CACHE_DIR': os.path.join(workdir, 'audio'), 'THUMB_DIR': os.path.join(workdir, 'thumbs'),
+        'YTDLP_FALLBACK': '0', 'PYTHONPATH': os.path.join(ROOT, 'api'),
+    })
+    port = free_port()
+    if server == 'asgi':
+        cmd = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--app-dir', os.path.join(ROOT, 'api'),
+               '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning', '--backlog', '2048']
+    else:
+        cmd = [sys.executable, '-c', FLASK_SERVER, str(port)]
+    # stdout app diarahkan ke stderr biar gak nyampur sama laporan JSON
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=sys.stderr)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None: raise RuntimeError(f"App keluar duluan (exit {proc.returncode})")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return f"http://127.0.0.1:{port}", proc
+        except OSError:
+            time.sleep(0.1)
+    stop_app(proc)
+    raise RuntimeError(f"App gak siap dalam {timeout} detik")
+
+def stop_app(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline Flinn Music vs mock Piped')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--target', help='URL server yang udah jalan (mock & app gak dinyalain)')
+    parser.add_argument('--instance', action='append', default=[], help='profil mock Piped, bisa diulang')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'bobot operasi (default {DEFAULT_MIX})')
+    parser.add_argument('--duration', type=float, default=20, help='detik')
+    parser.add_argument('--requests', type=int, default=0, help='batas jumlah request (0 = sampai durasi habis)')
+    parser.add_argument('--warmup', type=float, default=2, help='detik pemanasan (gak ikut dihitung)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=300, help='jumlah query unik')
+    parser.add_argument('--songs', type=int, default=500, help='jumlah yt_id unik buat stream')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', help='tulis hasil JSON ke file (default stdout)')
+    args = parser.parse_args()
+
+    mix = {}
+    for part in args.mix.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ('search', 'stream', 'content', 'suggest', 'add'):
+            parser.error(f"operasi gak dikenal: {name}")
+        mix[name.strip()] = float(weight)
+
+    profiles = [parse_profile(text) for text in (args.instance or DEFAULT_INSTANCES)]
+    mocks = []
+    app_proc = None
+    workdir = tempfile.mkdtemp(prefix='flinn-bench-')
+    try:
+        if args.target:
+            target = args.target.rstrip('/')
+        else:
+            mocks = start_instances(profiles, seed=args.seed)
+            target, app_proc = start_app(args.server, mocks, workdir)
+
+        if args.warmup > 0:
+            run_load(target, Workload(mix, args.seed + 1000, args.queries, args.songs),
+                     args.concurrency, args.warmup, 0, args.timeout)
+        results, elapsed = run_load(target, Workload(mix, args.seed, args.queries, args.songs),
+                                    args.concurrency, args.duration, args.requests, args.timeout)
+    finally:
+        if app_proc: stop_app(app_proc)
+        for m in mocks: m.stop()
+        # DB + cache audio/thumb punya app bench, jangan numpuk di /tmp tiap run
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(), 'started_at': int(time.time()), 'python': platform.python_version(),
+            'server': 'external' if args.target else args.server, 'target': target,
+            'concurrency': args.concurrency, 'duration_s': round(elapsed, 3), 'seed': args.seed,
+            'mix': mix, 'queries': args.queries, 'songs': args.songs,
+            'instances': [] if args.target else [dict(p, requests=m.requests) for p, m in zip(profiles, mocks)],
+        },
+        'total': summarize([s for samples in results.values() for s in samples], elapsed),
+        'ops': {op: summarize(samples, elapsed) for op, samples in sorted(results.items())},
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()